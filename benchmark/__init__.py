@@ -0,0 +1,84 @@
+import random
+import time
+import json
+from datetime import datetime, timedelta
+from contextlib import contextmanager
+from pathlib import Path
+
+from rep2recall.engine.db import Db
+from rep2recall.engine.migrate import index_note_fields
+from rep2recall.engine.util import toEpoch
+
+
+def synthetic_db(filename: str, n_cards: int, n_decks: int = 200, seed: int = 0, **kwargs) -> Db:
+    """
+    Fills a collection with raw SQL, bypassing `Db.insertMany`, so that building it is not the bottleneck.
+    `kwargs` are passed to `Db`.
+    """
+    if Path(filename).exists():
+        Path(filename).unlink()
+
+    rnd = random.Random(seed)
+    db = Db(filename, **kwargs)
+
+    decks = []
+    for i in range(n_decks):
+        parent = rnd.choice(decks) if decks and rnd.random() < 0.7 else None
+        decks.append(f"{parent}/D{i}" if parent else f"D{i}")
+
+    db.conn.executemany("INSERT INTO deck (name) VALUES (?)", ((d,) for d in decks))
+    db.conn.executemany("INSERT INTO tag (name) VALUES (?)", ((f"tag{i}",) for i in range(50)))
+
+    now = datetime.now()
+    db.conn.executemany("""
+    INSERT INTO note (key, data) VALUES (?, ?)
+    """, ((f"note{i}", json.dumps([
+        {"key": "Front", "value": f"word{i}"},
+        {"key": "Back", "value": f"meaning {rnd.randint(0, n_cards)}"}
+    ])) for i in range(n_cards // 2)))
+    index_note_fields(db.conn, "1")
+
+    db.conn.executemany("""
+    INSERT INTO card (deckId, noteId, front, back, srsLevel, nextReview, created, streakRight, streakWrong)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, ((
+        rnd.randint(1, n_decks),
+        i // 2 + 1 if i < n_cards // 2 * 2 else None,
+        f"front {i}",
+        f"back {i}",
+        rnd.randint(0, 7) if rnd.random() < 0.7 else None,
+        toEpoch(now + timedelta(hours=rnd.randint(-24, 24 * 30))) if rnd.random() < 0.7 else None,
+        toEpoch(now),
+        rnd.randint(0, 10),
+        rnd.randint(0, 10)
+    ) for i in range(n_cards)))
+
+    db.conn.executemany("""
+    INSERT OR IGNORE INTO cardTag (cardId, tagId) VALUES (?, ?)
+    """, ((rnd.randint(1, n_cards), rnd.randint(1, 50)) for _ in range(n_cards)))
+
+    db.conn.commit()
+
+    return db
+
+
+@contextmanager
+def timer(label: str, n: int = None, unit: str = "items"):
+    start = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - start
+
+    if n:
+        print(f"{label}: {elapsed:.3f}s ({n / elapsed:,.0f} {unit}/s)")
+    else:
+        print(f"{label}: {elapsed:.3f}s")
+
+
+def best_of(fn, repeat: int = 5) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    return min(times)
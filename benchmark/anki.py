@@ -0,0 +1,89 @@
+"""
+Importing an Anki .apkg (`/api/io/import`), in cards per second, with each card committed on its own,
+then chunked, rendering templates with 1, 2, 4... worker processes, up to the number of CPUs.
+
+    python -m benchmark.anki [n_notes] [n_media]
+"""
+import os
+import sys
+import json
+import random
+import sqlite3
+from zipfile import ZipFile
+from tempfile import mkdtemp
+from pathlib import Path
+
+from rep2recall.engine.anki import Anki
+from rep2recall.engine.db import Db
+from . import timer
+
+
+def synthetic_apkg(filename: str, n_notes: int, n_media: int = 0, n_decks: int = 20, seed: int = 0):
+    """
+    A minimal Anki package, of a two-template model, i.e. two cards per note.
+    """
+    rnd = random.Random(seed)
+    tmp = Path(mkdtemp())
+
+    decks = {str(i + 1): {"id": i + 1, "name": "::".join(["Anki"] + [f"D{j}" for j in range(i % 3 + 1)]) + f"{i}"}
+             for i in range(n_decks)}
+    models = {"1": {
+        "id": 1,
+        "name": "Basic (and reversed card)",
+        "flds": [{"name": "Front"}, {"name": "Back"}],
+        "css": ".card { font-family: arial; }",
+        "tmpls": [
+            {"name": "Card 1", "qfmt": "{{Front}}", "afmt": "{{FrontSide}}<hr id=answer>{{Back}}"},
+            {"name": "Card 2", "qfmt": "{{Back}}", "afmt": "{{FrontSide}}<hr id=answer>{{Front}}"}
+        ]
+    }}
+
+    conn = sqlite3.connect(str(tmp.joinpath("collection.anki2")))
+    conn.executescript("""
+    CREATE TABLE col (decks TEXT, models TEXT);
+    CREATE TABLE notes (id INTEGER PRIMARY KEY, mid INTEGER, flds TEXT, tags TEXT);
+    CREATE TABLE cards (id INTEGER PRIMARY KEY, nid INTEGER, did INTEGER);
+    """)
+    conn.execute("INSERT INTO col (decks, models) VALUES (?, ?)", (json.dumps(decks), json.dumps(models)))
+    conn.executemany("INSERT INTO notes (id, mid, flds, tags) VALUES (?, 1, ?, ?)", ((
+        i + 1,
+        f"word{i}\x1fmeaning {i}" + (f' <img src="media{i % n_media}.jpg">' if n_media else ""),
+        f" tag{rnd.randint(0, 50)} "
+    ) for i in range(n_notes)))
+    conn.executemany("INSERT INTO cards (nid, did) VALUES (?, ?)",
+                     ((i // 2 + 1, rnd.randint(1, n_decks)) for i in range(n_notes * 2)))
+    conn.commit()
+    conn.close()
+
+    with ZipFile(filename, "w") as zf:
+        zf.write(str(tmp.joinpath("collection.anki2")), "collection.anki2")
+        zf.writestr("media", json.dumps({str(i): f"media{i}.jpg" for i in range(n_media)}))
+        for i in range(n_media):
+            zf.writestr(str(i), rnd.randbytes(rnd.randint(1000, 100000)))
+
+
+def main(n_notes: int = 50000, n_media: int = 0):
+    tmp = Path(mkdtemp())
+    filename = str(tmp.joinpath("deck.apkg"))
+
+    runs = [("per card", 1, 1, min(n_notes, 2000))]
+    workers = 1
+    while workers <= (os.cpu_count() or 1):
+        runs.append((f"{workers} worker" + ("s" if workers > 1 else ""), 1000, workers, n_notes))
+        workers *= 2
+
+    for i, (label, chunk_size, workers, n) in enumerate(runs):
+        if i < 2:
+            synthetic_apkg(filename, n, n_media)
+
+        db = Db(str(tmp.joinpath(f"{i}.db")))
+        with timer(f"{label:>10}", n * 2, "cards"):
+            anki = Anki(filename, "deck.apkg", lambda x: None)
+            anki.export(db, chunk_size, workers)
+            anki.close()
+
+        db.close()
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
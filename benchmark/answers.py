@@ -0,0 +1,38 @@
+"""
+Review answers (`Db.markRight`/`Db.markWrong`) written one commit each, and written behind in batches.
+
+    python -m benchmark.answers [n_cards] [n_answers]
+"""
+import sys
+import random
+from tempfile import mkdtemp
+from pathlib import Path
+
+from . import synthetic_db, timer
+
+
+def main(n_cards: int = 50000, n_answers: int = 20000):
+    tmp = Path(mkdtemp())
+
+    for label, kwargs in [
+        ("sync", dict()),
+        ("write-behind", dict(answerFlushInterval=0.5, answerFlushSize=500))
+    ]:
+        db = synthetic_db(str(tmp.joinpath(f"{label}.db")), n_cards, **kwargs)
+        rnd = random.Random(0)
+
+        with timer(f"{label:>12}", n_answers, "answers"):
+            for _ in range(n_answers):
+                cardId = rnd.randint(1, n_cards)
+                if rnd.random() < 0.8:
+                    db.markRight(cardId)
+                else:
+                    db.markWrong(cardId)
+
+            db.flushAnswers()
+
+        db.close()
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
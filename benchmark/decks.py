@@ -0,0 +1,38 @@
+"""
+Deck subtree queries, as `/api/quiz/` and `/api/io/export` build them, by deck name prefix and by `$deck`;
+and renaming a deck subtree.
+
+    python -m benchmark.decks [n_cards]
+"""
+import sys
+from tempfile import mkdtemp
+from pathlib import Path
+
+from rep2recall.engine.typing import IParserResult, ICondOptions
+from . import synthetic_db, best_of, timer
+
+
+def main(n_cards: int = 200000):
+    filename = str(Path(mkdtemp()).joinpath("bench.db"))
+    db = synthetic_db(filename, n_cards)
+    deck = db.conn.execute("SELECT name FROM deck WHERE name NOT LIKE '%/%' LIMIT 1").fetchone()[0]
+
+    for label, cond in [
+        ("name prefix", {"$or": [
+            {"deck": {"$startswith": deck + "/"}},
+            {"deck": deck}
+        ]}),
+        ("$deck", {"$deck": deck})
+    ]:
+        t = best_of(lambda: db.parseCond(IParserResult(cond=cond), ICondOptions(fields=["id"])), 3)
+        print(f"{label:>12}: {t * 1000:8.1f} ms")
+
+    n = db.parseCond(IParserResult(cond={"$deck": deck}), ICondOptions(limit=1)).count
+    with timer("rename subtree", n, "cards"):
+        db.renameDeck(deck, "renamed/" + deck)
+
+    db.close()
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
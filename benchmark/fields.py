@@ -0,0 +1,27 @@
+"""
+Searching by note field, e.g. `@Front=word1`, in SQL and with a Python residual.
+
+    python -m benchmark.fields [n_cards]
+"""
+import sys
+from tempfile import mkdtemp
+from pathlib import Path
+
+from rep2recall.engine.search import SearchParser
+from . import synthetic_db, best_of
+
+
+def main(n_cards: int = 200000):
+    filename = str(Path(mkdtemp()).joinpath("bench.db"))
+    db = synthetic_db(filename, n_cards)
+
+    for q in ["@Front=word1", "front:word12", "back:\"meaning 1\"", "@Front>word9"]:
+        cond = SearchParser().parse(q)
+        t = best_of(lambda: db.parseCond(cond), 3)
+        print(f"{q!r:>24}: {t * 1000:8.1f} ms")
+
+    db.close()
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,59 @@
+"""
+Due-card and deck-subtree queries, without and with the hot-path indexes of schema version 2.
+
+    python -m benchmark.indexes [n_cards]
+"""
+import sys
+from datetime import datetime, timedelta
+from tempfile import mkdtemp
+from pathlib import Path
+
+from rep2recall.engine.migrate import MIGRATIONS
+from rep2recall.engine.util import toEpoch
+from . import synthetic_db, best_of
+
+
+def main(n_cards: int = 200000):
+    filename = str(Path(mkdtemp()).joinpath("bench.db"))
+    db = synthetic_db(filename, n_cards)
+    conn = db.conn
+
+    due = toEpoch(datetime.now() + timedelta(hours=1))
+    deck = conn.execute("SELECT name FROM deck WHERE name NOT LIKE '%/%' LIMIT 1").fetchone()[0]
+
+    queries = {
+        "due cards": ("""
+        SELECT id FROM card WHERE nextReview <= ?
+        """, (due,)),
+        "deck subtree": ("""
+        SELECT c.id FROM card AS c
+        INNER JOIN deck AS d ON d.id = c.deckId
+        WHERE d.name = ? OR substr(d.name, 1, ?) = ?
+        """, (deck, len(deck) + 1, deck + "/")),
+        "leech in deck subtree": ("""
+        SELECT c.id FROM card AS c
+        INNER JOIN deck AS d ON d.id = c.deckId
+        WHERE c.srsLevel = 0 AND (d.name = ? OR substr(d.name, 1, ?) = ?)
+        """, (deck, len(deck) + 1, deck + "/"))
+    }
+
+    def _run(label: str):
+        for name, (sql, params) in queries.items():
+            n = len(conn.execute(sql, params).fetchall())
+            t = best_of(lambda: conn.execute(sql, params).fetchall())
+            print(f"{label:>10} | {name:<22} | {n:>7} rows | {t * 1000:8.2f} ms")
+
+    for idx in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx_%'").fetchall():
+        conn.execute(f"DROP INDEX {idx[0]}")
+    conn.commit()
+    _run("no index")
+
+    conn.executescript(MIGRATIONS[1])
+    conn.execute("ANALYZE")
+    _run("indexed")
+
+    db.close()
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
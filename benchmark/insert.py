@@ -0,0 +1,59 @@
+"""
+Throughput of `Db.insertMany`, in cards per second, for plain, tagged and templated entries.
+
+    python -m benchmark.insert [n_cards]
+"""
+import sys
+import random
+from tempfile import mkdtemp
+from pathlib import Path
+
+from rep2recall.engine.db import Db
+from . import timer
+
+
+def _entries(n_cards: int, kind: str, seed: int = 0):
+    rnd = random.Random(seed)
+
+    for i in range(n_cards):
+        e = {
+            "front": f"front {i}",
+            "back": f"back {i}",
+            "deck": f"D{rnd.randint(0, 200)}"
+        }
+
+        if kind in {"tagged", "templated"}:
+            e["tag"] = [f"tag{rnd.randint(0, 50)}" for _ in range(3)]
+
+        if kind == "templated":
+            e.update({
+                "front": "@template\n{{Front}}",
+                "back": "@template\n{{FrontSide}}<hr>{{Back}}",
+                "template": "Forward",
+                "model": "Basic",
+                "key": f"note{i // 2}",
+                "data": [
+                    {"key": "Front", "value": f"word{i // 2}"},
+                    {"key": "Back", "value": f"meaning {i // 2}"}
+                ],
+                "source": "benchmark",
+                "sH": "benchmark",
+                "sCreated": "2020-01-01"
+            })
+
+        yield e
+
+
+def main(n_cards: int = 50000):
+    tmp = Path(mkdtemp())
+
+    for kind in ["plain", "tagged", "templated"]:
+        db = Db(str(tmp.joinpath(f"{kind}.db")))
+        with timer(f"{kind:>10}", n_cards, "cards"):
+            db.insertMany(_entries(n_cards, kind))
+
+        db.close()
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
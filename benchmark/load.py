@@ -0,0 +1,95 @@
+"""
+Review traffic (quiz build, render, answer) from several threads, while a large import is running,
+with a single shared connection and with the reader pool.
+
+    python -m benchmark.load [n_cards] [n_import] [n_reviewers]
+"""
+import sys
+import time
+import random
+import threading
+from datetime import datetime
+from tempfile import mkdtemp
+from pathlib import Path
+
+from rep2recall.engine.db import Db
+from rep2recall.engine.typing import IParserResult, ICondOptions
+from rep2recall.engine.util import toEpoch
+from . import synthetic_db
+from .insert import _entries
+
+
+def _percentile(xs, p: float) -> float:
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(len(xs) * p))] if xs else float("nan")
+
+
+def _run(filename: str, n_import: int, n_reviewers: int, readerPoolSize: int):
+    db = Db(filename, readerPoolSize=readerPoolSize)
+    decks = [r[0] for r in db.conn.execute("SELECT name FROM deck")]
+    done = threading.Event()
+    readLatencies = []
+    answerLatencies = []
+    errors = []
+
+    def _import():
+        try:
+            db.insertMany(_entries(n_import, "tagged", seed=1))
+        finally:
+            done.set()
+
+    def _review(seed: int):
+        rnd = random.Random(seed)
+        while not done.is_set():
+            try:
+                start = time.perf_counter()
+                ids = [c["id"] for c in db.parseCond(IParserResult({"$and": [
+                    {"deck": rnd.choice(decks)},
+                    {"nextReview": {"$lte": toEpoch(datetime.now())}}
+                ]}), ICondOptions(fields=["id"], limit=20)).data]
+
+                if ids:
+                    cardId = rnd.choice(ids)
+                    db.render(cardId)
+                    readLatencies.append(time.perf_counter() - start)
+
+                    start = time.perf_counter()
+                    if rnd.random() < 0.8:
+                        db.markRight(cardId)
+                    else:
+                        db.markWrong(cardId)
+                    answerLatencies.append(time.perf_counter() - start)
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=_review, args=(i,)) for i in range(n_reviewers)]
+    importer = threading.Thread(target=_import)
+
+    start = time.perf_counter()
+    for t in threads + [importer]:
+        t.start()
+    for t in threads + [importer]:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    label = f"pool of {readerPoolSize}" if readerPoolSize else "shared conn"
+    print(f"{label:>12} | import {elapsed:6.2f}s | {len(answerLatencies):>5} reviews | "
+          f"quiz+render p50 {_percentile(readLatencies, 0.5) * 1000:6.1f} ms, "
+          f"p95 {_percentile(readLatencies, 0.95) * 1000:6.1f} ms | "
+          f"answer p50 {_percentile(answerLatencies, 0.5) * 1000:6.1f} ms, "
+          f"p95 {_percentile(answerLatencies, 0.95) * 1000:6.1f} ms | "
+          f"{len(errors)} errors")
+
+    db.close()
+
+
+def main(n_cards: int = 50000, n_import: int = 50000, n_reviewers: int = 4):
+    tmp = Path(mkdtemp())
+    for readerPoolSize in [0, 4]:
+        filename = str(tmp.joinpath(f"bench{readerPoolSize}.db"))
+        synthetic_db(filename, n_cards).close()
+        _run(filename, n_import, n_reviewers, readerPoolSize)
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
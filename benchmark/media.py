@@ -0,0 +1,43 @@
+"""
+Importing an Anki .apkg with media twice, with every file inline in the collection and with the media folder;
+and the size of the collection after each import.
+
+    python -m benchmark.media [n_notes] [n_media]
+"""
+import os
+import sys
+from tempfile import mkdtemp
+from pathlib import Path
+
+from rep2recall.engine.anki import Anki
+from rep2recall.engine.db import Db
+from . import timer
+from .anki import synthetic_apkg
+
+
+def main(n_notes: int = 2000, n_media: int = 3000):
+    tmp = Path(mkdtemp())
+    filename = str(tmp.joinpath("deck.apkg"))
+    synthetic_apkg(filename, n_notes, n_media)
+
+    for label, media_folder in [
+        ("inline", None),
+        ("folder", tmp.joinpath("media"))
+    ]:
+        db_path = str(tmp.joinpath(f"{label}.db"))
+        db = Db(db_path)
+
+        for i in range(2):
+            with timer(f"{label:>8} import {i + 1}", n_media, "files"):
+                anki = Anki(filename, "deck.apkg", lambda x: None)
+                anki.export(db, media_folder=media_folder)
+                anki.close()
+
+            db.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            print(f"{'':>8} collection: {os.path.getsize(db_path) / 2 ** 20:,.1f} MiB")
+
+        db.close()
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
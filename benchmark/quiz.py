@@ -0,0 +1,39 @@
+"""
+Building a quiz of due cards, by SQL over the collection, and from the due queue; whole, and the next 20.
+
+    python -m benchmark.quiz [n_cards]
+"""
+import sys
+from datetime import datetime
+from tempfile import mkdtemp
+from pathlib import Path
+
+from rep2recall.engine.typing import IParserResult, ICondOptions
+from rep2recall.engine.util import toEpoch
+from . import synthetic_db, best_of, timer
+
+
+def main(n_cards: int = 200000):
+    filename = str(Path(mkdtemp()).joinpath("bench.db"))
+    db = synthetic_db(filename, n_cards)
+    deck = db.conn.execute("SELECT name FROM deck WHERE name NOT LIKE '%/%' LIMIT 1").fetchone()[0]
+
+    with timer("build due queue", n_cards, "cards"):
+        db.getDueQueue()
+
+    for label, d in [("collection", None), ("deck subtree", deck)]:
+        cond = {"nextReview": {"$lte": toEpoch(datetime.now())}}
+        if d:
+            cond = {"$and": [cond, {"$deck": d}]}
+
+        for limit in [None, 20]:
+            t0 = best_of(lambda: db.parseCond(IParserResult(cond=cond), ICondOptions(fields=["id"], limit=limit)), 3)
+            t1 = best_of(lambda: db.getDue(d, datetime.now(), limit=limit), 3)
+            print(f"{label:>12}, {'all' if limit is None else limit:>3} cards: "
+                  f"SQL {t0 * 1000:8.1f} ms, due queue {t1 * 1000:8.1f} ms")
+
+    db.close()
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
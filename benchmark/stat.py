@@ -0,0 +1,28 @@
+"""
+Searching by answer streak, e.g. `stat.streak.wrong>5`, which is compiled to SQL on the indexed streak columns.
+
+    python -m benchmark.stat [n_cards]
+"""
+import sys
+from tempfile import mkdtemp
+from pathlib import Path
+
+from rep2recall.engine.search import SearchParser
+from rep2recall.engine.typing import ICondOptions
+from . import synthetic_db, best_of
+
+
+def main(n_cards: int = 200000):
+    filename = str(Path(mkdtemp()).joinpath("bench.db"))
+    db = synthetic_db(filename, n_cards)
+
+    for q in ["stat.streak.wrong>8", "stat.streak.right=0 is:due", "-sortBy:stat.streak.wrong"]:
+        cond = SearchParser().parse(q)
+        t = best_of(lambda: db.parseCond(cond, ICondOptions(limit=20)), 3)
+        print(f"{q!r:>32}: {t * 1000:8.1f} ms")
+
+    db.close()
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,28 @@
+"""
+Adding and removing tags on many cards at once, as `/api/editor/addTags` and `/api/editor/removeTags` do.
+
+    python -m benchmark.tags [n_cards]
+"""
+import sys
+from tempfile import mkdtemp
+from pathlib import Path
+
+from . import synthetic_db, timer
+
+
+def main(n_cards: int = 100000):
+    filename = str(Path(mkdtemp()).joinpath("bench.db"))
+    db = synthetic_db(filename, n_cards)
+    ids = [r[0] for r in db.conn.execute("SELECT id FROM card")]
+
+    with timer("add 2 tags", n_cards, "cards"):
+        db.addTags(ids, ["benchmark", "tag1"])
+
+    with timer("remove 2 tags", n_cards, "cards"):
+        db.removeTags(ids, ["benchmark", "tag1"])
+
+    db.close()
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
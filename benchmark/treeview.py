@@ -0,0 +1,28 @@
+"""
+Deck treeview of the home page (`/api/quiz/treeview`), over the whole collection and over a search.
+
+    python -m benchmark.treeview [n_cards] [n_decks]
+"""
+import os
+import sys
+from tempfile import mkdtemp
+from pathlib import Path
+
+from . import synthetic_db, best_of
+
+
+def main(n_cards: int = 100000, n_decks: int = 500):
+    filename = str(Path(mkdtemp()).joinpath("user.db"))
+    synthetic_db(filename, n_cards, n_decks).close()
+
+    os.environ["COLLECTION"] = filename
+    from rep2recall.server import app
+    client = app.test_client()
+
+    for q in ["", "tag:tag1", "front"]:
+        t = best_of(lambda: client.post("/api/quiz/treeview", json={"q": q}), 3)
+        print(f"{q!r:>12}: {t * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
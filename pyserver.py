@@ -1,4 +1,9 @@
-from rep2recall.server import run_server
+import multiprocessing
 
 if __name__ == "__main__":
+    # Anki imports render in spawned processes, which a frozen build has to dispatch;
+    # the server is not imported at the top, as those processes run this module again.
+    multiprocessing.freeze_support()
+
+    from rep2recall.server import run_server
     run_server()
@@ -1,4 +1,4 @@
-from .server import run_server
-
 if __name__ == "__main__":
+    # Not imported at the top, as processes spawned by Anki imports run this module again.
+    from .server import run_server
     run_server()
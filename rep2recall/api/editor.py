@@ -2,8 +2,9 @@ from flask import Blueprint, request, Response, jsonify
 from random import shuffle
 
 from ..shared import Config
-from ..engine.search import mongo_filter, sorter, SearchParser
-from ..engine.util import ankiMustache
+from ..engine.search import mongo_filter, sort_page, SearchParser
+from ..engine.util import ankiMustache, fromEpoch
+from ..engine.typing import IParserResult, ICondOptions
 
 api_editor = Blueprint("editor", __name__, url_prefix="/api/editor")
 
@@ -28,15 +29,35 @@ def r_editor():
 
         if sort_by is None:
             sort_by = r.get("sortBy", "deck")
-
-        if desc is None:
             desc = r.get("desc", False)
 
+        if is_ == "random":
+            sort_by = "random"
+
+        offset = r.get("offset", 0)
+        limit = r.get("limit", 10)
+
+        if is_ not in {"duplicate", "distinct"}:
+            try:
+                result = db.parseCond(IParserResult(cond=cond, sortBy=sort_by, desc=desc), ICondOptions(
+                    offset=offset,
+                    limit=limit,
+                    cursor=r.get("cursor")
+                ))
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+
+            return jsonify({
+                "data": [_format_dates(c) for c in result.data],
+                "count": result.count,
+                "cursor": result.cursor
+            })
+
         if is_ == "duplicate":
             sort_by = "front"
 
             counter = dict()
-            for data in db.getAll():
+            for data in db.iterAll():
                 if data.get("tFront"):
                     counter.setdefault(ankiMustache(data["tFront"], data.get("data", dict())), []).append(data)
                 else:
@@ -46,32 +67,29 @@ def r_editor():
             for v in counter.values():
                 if len(v) > 1:
                     all_data.extend(v)
-        elif is_ == "distinct":
+        else:
+            sort_by = "random"
+
             distinct_set = set()
             all_data = []
-            for data in db.getAll():
+            for data in db.iterAll():
                 key = data.get("key", data["front"])
                 if key not in distinct_set:
                     all_data.append(data)
                     distinct_set.add(key)
-        else:
-            all_data = db.getAll()
 
-        if is_ == "distinct":
-            sort_by = "random"
+        all_data = filter(mongo_filter(cond), all_data)
 
         if sort_by == "random":
-            all_data = list(filter(mongo_filter(cond), all_data))
+            all_data = list(all_data)
             shuffle(all_data)
-        else:
-            all_data = sorted(filter(mongo_filter(cond), all_data),
-                              key=sorter(sort_by, desc))
+            sort_by = None
 
-        offset = r.get("offset", 0)
+        page, count = sort_page(all_data, sort_by, desc, offset, limit)
 
         return jsonify({
-            "data": all_data[offset: offset + r.get("limit", 10)],
-            "count": len(all_data)
+            "data": [_format_dates(c) for c in page],
+            "count": count
         })
 
     elif request.method == "PUT":
@@ -106,6 +124,14 @@ def r_editor():
     return Response(status=404)
 
 
+def _format_dates(c: dict) -> dict:
+    for k in ["nextReview", "created", "modified"]:
+        if k in c:
+            c[k] = fromEpoch(c[k])
+
+    return c
+
+
 @api_editor.route("/addTags", methods=["PUT"])
 def r_editor_add_tags():
     d = request.json
@@ -120,3 +146,14 @@ def r_editor_remove_tags():
     Config.DB.removeTags(d["ids"], d["tags"])
 
     return jsonify({"error": None})
+
+
+@api_editor.route("/renameDeck", methods=["PUT"])
+def r_editor_rename_deck():
+    d = request.json
+    try:
+        Config.DB.renameDeck(d["old"], d["new"])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({"error": None})
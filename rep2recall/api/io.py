@@ -7,7 +7,6 @@ from gevent import sleep
 from ..shared import Config
 from ..engine.anki import Anki
 from ..engine.db import Db
-from ..engine.search import mongo_filter
 
 api_io = Blueprint("io", __name__, url_prefix="/api/io")
 
@@ -31,11 +30,17 @@ def r_import_progress(msg):
         filename = FILE_ID_TO_NAME[msg["id"]]
         if msg["type"] == ".apkg":
             anki = Anki(str(Config.UPLOAD_FOLDER.joinpath(msg["id"])), filename,
-                        lambda x: (send(x), sleep(1)))
-            anki.export(Config.DB)
+                        lambda x: (send(x), sleep(0)))
+            try:
+                anki.export(Config.DB, workers=Config.IMPORT_WORKERS, media_folder=Config.MEDIA_FOLDER)
+            finally:
+                anki.close()
         elif msg["type"] == ".r2r":
             import_db = Db(str(Config.UPLOAD_FOLDER.joinpath(msg["id"])))
-            Config.DB.insertMany(import_db.getAll())
+            try:
+                Config.DB.insertMany(import_db.iterAll())
+            finally:
+                import_db.close()
         else:
             raise ValueError(f"Invalid file type {msg['type']}")
 
@@ -63,11 +68,9 @@ def r_export():
     new_file = Db(str(Config.UPLOAD_FOLDER.joinpath(filename)))
     db = Config.DB
 
-    new_file.insertMany(list(map(_clean_deck, filter(mongo_filter({"$or": [
-        {"deck": deck},
-        {"deck": {"$startswith": f"{deck}/"}}
-    ]}), db.getAll()))))
-
-    new_file.close()
+    try:
+        new_file.insertMany(map(_clean_deck, db.iterAll({"$deck": deck})))
+    finally:
+        new_file.close()
 
     return send_file(filename, attachment_filename=f"{secure_filename(deck)}.r2r", as_attachment=True, cache_timeout=-1)
@@ -2,6 +2,7 @@ from flask import Blueprint, send_file, jsonify, send_from_directory
 from io import BytesIO
 
 from ..shared import Config
+from ..engine.media import blob_path
 
 api_media = Blueprint("media", __name__, url_prefix="/api/media")
 
@@ -9,11 +10,15 @@ api_media = Blueprint("media", __name__, url_prefix="/api/media")
 @api_media.route("/<int:media_id>")
 def r_media(media_id: int):
     db = Config.DB
-    name, b = db.conn.execute("""
-    SELECT name, data
-    FROM media 
-    WHERE id = ?
-    """, (media_id,)).fetchone()
+    with db.reader() as conn:
+        name, b, h = conn.execute("""
+        SELECT name, data, h
+        FROM media
+        WHERE id = ?
+        """, (media_id,)).fetchone()
+
+    if b is None:
+        return send_file(str(blob_path(Config.MEDIA_FOLDER, h)), attachment_filename=name)
 
     return send_file(BytesIO(b), attachment_filename=name)
 
@@ -1,68 +1,43 @@
 from flask import Blueprint, request, jsonify
 from datetime import datetime
-from typing import List
+from typing import Any, Optional
+import math
 
 from ..shared import Config
 from ..engine.search import SearchParser, parse_timedelta
 from ..engine.typing import ICondOptions, IParserResult
+from ..engine.util import toEpoch
 
 api_quiz = Blueprint("quiz", __name__, url_prefix="/api/quiz")
 
 
 @api_quiz.route("/treeview", methods=["POST"])
 def r_quiz_treeview():
-    def _recurse_parse_data(_data: List[dict], _deck: List[str], _depth: int = 0):
-        do_loop = True
-
-        while _depth < len(_deck) - 1:
-            for c in _data:
-                if c["name"] == _deck[_depth]:
-                    c["children"] = c.get("children", [])
-                    _recurse_parse_data(c["children"], _deck, _depth + 1)
-                    do_loop = False
-                    break
-
-            _depth += 1
-
-            if not do_loop:
-                break
-
-        if do_loop and _depth == len(_deck) - 1:
-            full_name = "/".join(deck)
-            deck_items = [d for d in all_items if d["deck"].startswith(full_name)]
-
-            _data.append({
-                "name": _deck[_depth],
-                "fullName": full_name,
-                "isOpen": _depth < 2,
-                "stat": {
-                    "new": len([d for d in deck_items if not d.get("nextReview")]),
-                    "leech": len([d for d in deck_items if d.get("srsLevel") == 0]),
-                    "due": len([d for d in deck_items if d.get("nextReview") and
-                                datetime.fromisoformat(d["nextReview"]) < now])
-                }
-            })
-
     db = Config.DB
-    all_items = db.parseCond(SearchParser().parse(request.json["q"]), ICondOptions(
-        fields=["deck", "nextReview", "srsLevel"]
-    )).data
-    now = datetime.now()
+    counts = db.countByDeck(SearchParser().parse(request.json["q"]).cond)
 
-    deck_list = sorted(set(d["deck"] for d in all_items))
-    deck_with_subdecks = []
+    full_data = []
+    nodes = dict()
 
-    for d in deck_list:
+    for d in sorted(counts.keys()):
         deck = d.split("/")
-        for i, _ in enumerate(deck):
-            subdeck = "/".join(deck[:i + 1])
-            if subdeck not in deck_with_subdecks:
-                deck_with_subdecks.append(subdeck)
+        for i, name in enumerate(deck):
+            full_name = "/".join(deck[:i + 1])
+            if full_name not in nodes:
+                nodes[full_name] = {
+                    "name": name,
+                    "fullName": full_name,
+                    "isOpen": i < 2,
+                    "stat": {"new": 0, "leech": 0, "due": 0}
+                }
 
-    full_data = []
-    for d in deck_with_subdecks:
-        deck = d.split("/")
-        _recurse_parse_data(full_data, deck)
+                if i == 0:
+                    full_data.append(nodes[full_name])
+                else:
+                    nodes["/".join(deck[:i])].setdefault("children", []).append(nodes[full_name])
+
+            for k, v in counts[d].items():
+                nodes[full_name]["stat"][k] += v
 
     return jsonify(full_data)
 
@@ -70,18 +45,31 @@ def r_quiz_treeview():
 @api_quiz.route("/", methods=["POST"])
 def r_quiz_build():
     r = request.json
-    and_cond = [SearchParser().parse(r["q"]).cond]
+    db = Config.DB
+    cond = SearchParser().parse(r["q"]).cond
+    limit = r.get("limit")
+
+    # Without a search, due and new cards come from the due queue, most overdue first.
+    if not cond:
+        now = datetime.now()
+        type_ = r.get("type")
+        due = now + parse_timedelta(r["due"]) if r.get("due") else None
+
+        if type_ not in {"all", "leech", "new"}:
+            return jsonify({"ids": db.getDue(r.get("deck"), min(now, due) if due else now,
+                                             includeNew=type_ != "due" and not due, limit=limit)})
+        elif type_ == "new" and not due:
+            return jsonify({"ids": db.getDue(r.get("deck"), includeNew=True, limit=limit)})
+
+    and_cond = [cond]
 
     if r.get("deck"):
-        and_cond.append({"$or": [
-            {"deck": {"$startswith": r["deck"] + "/"}},
-            {"deck": r["deck"]}
-        ]})
+        and_cond.append({"$deck": r["deck"]})
 
     if r.get("type") != "all":
         type_ = r.get("type")
         if type_ == "due":
-            and_cond.append({"nextReview": {"$lte": str(datetime.now())}})
+            and_cond.append({"nextReview": {"$lte": toEpoch(datetime.now())}})
         elif type_ == "leech":
             and_cond.append({"srsLevel": 0})
         elif type_ == "new":
@@ -89,19 +77,18 @@ def r_quiz_build():
         else:
             and_cond.append({"$or": [
                 {"nextReview": {"$exists": False}},
-                {"nextReview": {"$lte": str(datetime.now())}}
+                {"nextReview": {"$lte": toEpoch(datetime.now())}}
             ]})
 
     if r.get("due"):
-        and_cond.append({"nextReview": {"$lte": str(datetime.now() + parse_timedelta(r["due"]))}})
+        and_cond.append({"nextReview": {"$lte": toEpoch(datetime.now() + parse_timedelta(r["due"]))}})
     elif r.get("type") != "all":
         and_cond.append({"$or": [
             {"nextReview": {"$exists": False}},
-            {"nextReview": {"$lte": str(datetime.now())}}
+            {"nextReview": {"$lte": toEpoch(datetime.now())}}
         ]})
 
-    db = Config.DB
-    all_items = db.parseCond(IParserResult(cond={"$and": and_cond}), ICondOptions(fields=["id"])).data
+    all_items = db.parseCond(IParserResult(cond={"$and": and_cond}), ICondOptions(fields=["id"], limit=limit)).data
 
     return jsonify({"ids": [c["id"] for c in all_items]})
 
@@ -118,7 +105,12 @@ def r_quiz_render():
 def r_quiz_right():
     card_id = request.json["id"]
     db = Config.DB
-    db.markRight(card_id)
+    try:
+        duration = _duration(request.json.get("duration"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    db.markRight(card_id, duration)
 
     return jsonify({"error": None})
 
@@ -127,6 +119,37 @@ def r_quiz_right():
 def r_quiz_wrong():
     card_id = request.json["id"]
     db = Config.DB
-    db.markWrong(card_id)
+    try:
+        duration = _duration(request.json.get("duration"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    db.markWrong(card_id, duration)
 
     return jsonify({"error": None})
+
+
+def _duration(v: Any) -> Optional[int]:
+    """
+    Time to answer, in milliseconds, as sent by the client; ValueError if it is not a non-negative number
+    """
+    if v is None:
+        return None
+
+    try:
+        v = float(v)
+    except (TypeError, ValueError):
+        v = math.nan
+
+    if not 0 <= v < math.inf:
+        raise ValueError("Invalid duration")
+
+    return int(v)
+
+
+@api_quiz.route("/stats", methods=["POST"])
+def r_quiz_stats():
+    r = request.json or dict()
+    db = Config.DB
+
+    return jsonify(db.reviewStats(r.get("deck"), r.get("since"), r.get("until")))
@@ -2,37 +2,43 @@ import sqlite3
 from zipfile import ZipFile
 from tempfile import mkdtemp
 import hashlib
-from typing import Callable, Any, Union
+from typing import Callable, Any, Union, Iterator, Iterable, List, Optional, Tuple, Dict
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import multiprocessing
 import os
+import shutil
 import json
+import math
+import time
 from datetime import datetime
 from pathlib import Path
 import re
+import functools
 
-from .util import ankiMustache
-from .typing import IEntry, IDataSocket
+from .util import ankiMustache, chunks
+from .media import store as store_media, CHUNK_SIZE
 
 from .db import Db
 
 
+MEDIA_BATCH_SIZE = 1 << 24
+
+
 class Anki:
-    def __init__(self, file_path: str, true_filename: str, cb: Callable[[Union[dict, None]], Any]):
+    def __init__(self, file_path: str, true_filename: str, cb: Callable[[Union[dict, None]], Any],
+                 progress_interval: float = 0.5):
+        """
+        Progress events, i.e. those with `current`, are sent to `cb` at most every `progress_interval` seconds.
+        """
         self.file_path = file_path
         self.filename = true_filename
         self.dir = mkdtemp()
-        self.cb = cb
+        self.cb = _throttle(cb, progress_interval)
 
+        # Media are read from the archive on export; only the collection has to be a file, for SQLite.
         with ZipFile(file_path) as zf:
-            fs = zf.namelist()
-
-            for i, f in enumerate(fs):
-                self.cb({
-                    "text": f"Unzipping {f}",
-                    "current": i,
-                    "max": len(fs)
-                })
-
-                zf.extract(f, self.dir)
+            zf.extract("collection.anki2", self.dir)
 
         self.cb({
             "text": "Preparing Anki resources"
@@ -98,56 +104,43 @@ class Anki:
 
     def close(self):
         self.conn.close()
-        os.unlink(self.dir)
-
-    def export(self, db: Db) -> None:
+        shutil.rmtree(self.dir)
+
+    def export(self, db: Db, chunk_size: int = 1000, workers: int = 1,
+               media_folder: Union[str, Path, None] = None) -> None:
+        """
+        `workers` is the number of processes rendering card templates; 1 to render in this process.
+        Media larger than `media.INLINE_SIZE` are stored in `media_folder`, if given.
+        """
         self.cb({
             "text": "Writing to database"
         })
 
-        source_h = hashlib.md5(Path(self.file_path).read_bytes()).hexdigest()
-
-        db.conn.execute("""
-        INSERT INTO source (name, h, created)
-        VALUES (?, ?, ?)
-        ON CONFLICT DO NOTHING
-        """, (
-            self.filename,
-            source_h,
-            str(datetime.now())
-        ))
-        db.conn.commit()
-
-        source_id = db.conn.execute("""
-        SELECT id FROM source
-        WHERE h = ?
-        """, (source_h,)).fetchone()[0]
-
-        media_name_to_id = dict()
-        media_json = json.loads(Path(self.dir).joinpath("media").read_text())
-
-        assert isinstance(media_json, dict)
-        for i, k in enumerate(media_json.keys()):
-            data = Path(self.dir).joinpath(k).read_bytes()
-            h = hashlib.md5(data).hexdigest()
-
-            self.cb({
-                "text": "Uploading media",
-                "current": i,
-                "max": len(media_json)
-            })
+        h = hashlib.md5()
+        with open(self.file_path, "rb") as f:
+            for b in iter(lambda: f.read(CHUNK_SIZE), b""):
+                h.update(b)
+        source_h = h.hexdigest()
 
+        with db.writeLock:
             db.conn.execute("""
-            INSERT INTO media (sourceId, name, data, h)
-            VALUES (?, ?, ?, ?)
+            INSERT INTO source (name, h, created)
+            VALUES (?, ?, ?)
             ON CONFLICT DO NOTHING
-            """, (source_id, media_json[k], data, h))
+            """, (
+                self.filename,
+                source_h,
+                str(datetime.now())
+            ))
+            db.conn.commit()
 
-            media_name_to_id[media_json[k]] = db.conn.execute("""
-            SELECT id FROM media
+            source_id, source_created = db.conn.execute("""
+            SELECT id, created FROM source
             WHERE h = ?
-            """, (h,)).fetchone()[0]
-        db.conn.commit()
+            """, (source_h,)).fetchone()
+
+        with ZipFile(self.file_path) as zf:
+            media_name_to_id = self._import_media(db, zf, source_id, media_folder)
 
         ts = self.conn.execute("""
         SELECT t.name AS tname, m.name AS mname, qfmt, afmt, css
@@ -155,6 +148,7 @@ class Anki:
         INNER JOIN models AS m ON m.id = t.mid
         """).fetchall()
 
+        templates = []
         for i, t in enumerate(ts):
             self.cb({
                 "text": "Uploading templates",
@@ -162,10 +156,7 @@ class Anki:
                 "max": len(ts)
             })
 
-            db.conn.execute("""
-            INSERT INTO template (name, model, front, back, css, sourceId)
-            VALUES (?, ?, ?, ?, ?, ?)
-            """, (
+            templates.append((
                 t["tname"],
                 t["mname"],
                 self._convert_link(t["qfmt"], media_name_to_id),
@@ -173,10 +164,47 @@ class Anki:
                 self._convert_link(t["css"], media_name_to_id),
                 source_id
             ))
-        db.conn.commit()
 
-        front_set = set()
-        ns = self.conn.execute("""
+        with db.writeLock:
+            db.conn.executemany("""
+            INSERT INTO template (name, model, front, back, css, sourceId)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT DO NOTHING
+            """, templates)
+            db.conn.commit()
+
+        self.conn.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS frontHash (
+            h       VARCHAR PRIMARY KEY
+        ) WITHOUT ROWID
+        """)
+        self.conn.execute("DELETE FROM frontHash")
+
+        n_cards = self.conn.execute("""
+        SELECT COUNT(*)
+        FROM cards AS c
+        INNER JOIN decks AS d ON d.id = did
+        INNER JOIN notes AS n ON n.id = nid
+        INNER JOIN models AS m ON m.id = n.mid
+        INNER JOIN templates AS t ON t.mid = n.mid
+        """).fetchone()[0]
+
+        start = time.perf_counter()
+        n_imported = len(db.insertMany(self._iter_entries(source_h, source_created, n_cards, chunk_size, workers), chunk_size))
+        elapsed = time.perf_counter() - start
+
+        self.cb({
+            "text": f"Imported {n_imported} cards ({n_imported / elapsed if elapsed else 0:.0f} cards/s)",
+            "current": n_cards,
+            "max": n_cards
+        })
+
+    def _iter_entries(self, source_h: str, source_created: str, n_cards: int,
+                      chunk_size: int, workers: int) -> Iterator[dict]:
+        """
+        Cards of the collection, rendered and deduplicated by front, streamed from the cursor
+        """
+        rows = self.conn.execute("""
         SELECT
             n.flds AS "values",
             m.flds AS keys,
@@ -191,48 +219,95 @@ class Anki:
         INNER JOIN notes AS n ON n.id = nid
         INNER JOIN models AS m ON m.id = n.mid
         INNER JOIN templates AS t ON t.mid = n.mid
-        """).fetchall()
+        """)
+
+        i = 0
+        for chunk, hashes in _render_chunks(chunks(rows, chunk_size), workers):
+            self.cb({
+                "text": "Uploading notes",
+                "current": i,
+                "max": n_cards
+            })
+            i += len(chunk)
+
+            for n, h in zip(chunk, hashes):
+                if h is None:
+                    continue
+
+                front_h, back_h = h
+                if not self.conn.execute("""
+                INSERT OR IGNORE INTO frontHash (h) VALUES (?)
+                """, (front_h,)).rowcount:
+                    continue
+
+                vs = n["values"].split("\x1f")
+                ks = n["keys"].split("\x1f")
+
+                yield dict(
+                    deck=n["deck"].replace("::", "/"),
+                    model=n["mname"],
+                    template=n["tname"],
+                    key=f"{self.filename}/{n['mname']}/{vs[0]}",
+                    data=[dict(key=k, value=v) for k, v in zip(ks, vs)],
+                    front="@md5\n" + front_h,
+                    back="@md5\n" + back_h,
+                    tag=[x for x in n["tags"].split(" ") if x],
+                    source=self.filename,
+                    sH=source_h,
+                    sCreated=source_created
+                )
+
+    def _import_media(self, db: Db, zf: ZipFile, source_id: int,
+                      media_folder: Union[str, Path, None]) -> Dict[str, int]:
+        """
+        Media are streamed from the archive into the content-addressed store, see `media.store`,
+        and inserted and committed a batch at a time, of up to about `MEDIA_BATCH_SIZE` bytes inline.
+        """
+        media_json = json.loads(zf.read("media"))
+        assert isinstance(media_json, dict)
+
+        media_name_to_id = dict()
+        batch = []
+        batch_size = 0
+
+        def _flush():
+            with db.writeLock:
+                db.conn.executemany("""
+                INSERT INTO media (sourceId, name, data, h)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (h) DO NOTHING
+                """, batch)
+                db.conn.commit()
+
+                for hs in chunks(set(r[3] for r in batch), 500):
+                    h_to_id = dict(db.conn.execute(f"""
+                    SELECT h, id FROM media
+                    WHERE h IN ({",".join(["?"] * len(hs))})
+                    """, hs).fetchall())
+                    media_name_to_id.update((r[1], h_to_id[r[3]]) for r in batch if r[3] in h_to_id)
+
+        for i, (k, name) in enumerate(media_json.items()):
+            self.cb({
+                "text": "Uploading media",
+                "current": i,
+                "max": len(media_json)
+            })
+
+            with zf.open(k) as f:
+                h, data = store_media(f, zf.getinfo(k).file_size, media_folder)
+
+            batch.append((source_id, name, data, h))
+            batch_size += len(data) if data is not None else 0
+
+            if batch_size >= MEDIA_BATCH_SIZE or len(batch) >= 1000:
+                _flush()
+                batch = []
+                batch_size = 0
 
-        for i, n in enumerate(ns):
-            if i % 1000 == 0:
-                self.cb({
-                    "text": "Uploading notes",
-                    "current": i,
-                    "max": len(ns)
-                })
-
-            vs = n["values"].split("\x1f")
-            ks = n["keys"].split("\x1f")
-            data = []
-            for i_k, k in enumerate(ks):
-                data.append(IDataSocket(
-                    key=k,
-                    value=vs[i_k]
-                ))
-
-            front = ankiMustache(n["qfmt"], data)
-            if front == ankiMustache(n["qfmt"]):
-                continue
-
-            front = "@md5\n" + hashlib.md5(front.encode()).hexdigest()
-            if front in front_set:
-                continue
-
-            front_set.add(front)
-            back = ankiMustache(n["afmt"], data, front)
-            back = "@md5\n" + hashlib.md5(back.encode()).hexdigest()
-
-            db.insertMany([IEntry(
-                deck=n["deck"].replace("::", "/"),
-                model=n["mname"],
-                template=n["tname"],
-                key=f"{self.filename}/{n['mname']}/{vs[0]}",
-                data=data,
-                front=front,
-                back=back,
-                tag=[x for x in n["tags"].split(" ") if x],
-                sH=source_h
-            )])
+        if batch:
+            _flush()
+
+        return media_name_to_id
 
     @staticmethod
     def _convert_link(s: str, media_name_to_id: dict) -> str:
@@ -241,3 +316,73 @@ class Anki:
             lambda m: f"/media/{media_name_to_id[m[1]]}",
             s
         )
+
+
+def _throttle(cb: Callable[[Union[dict, None]], Any], interval: float) -> Callable[[Union[dict, None]], Any]:
+    """
+    Drops progress events sent sooner than `interval` seconds after the previous one, except the last of a stage
+    """
+    last = dict(t=-math.inf)
+
+    def throttled(x: Union[dict, None]):
+        if x and "current" in x and x["current"] < x.get("max", 0) - 1:
+            now = time.monotonic()
+            if now - last["t"] < interval:
+                return None
+
+            last["t"] = now
+
+        return cb(x)
+
+    return throttled
+
+
+def _render_chunks(row_chunks: Iterable[List[sqlite3.Row]], workers: int) -> Iterator[Tuple[list, list]]:
+    """
+    Yields each chunk with its `_render` result, in order. With more than one worker, chunks are rendered
+    in a process pool, with a bounded number in flight, so that the cursor is still streamed.
+    """
+    if workers <= 1:
+        for chunk in row_chunks:
+            yield chunk, _render([(n["values"], n["keys"], n["qfmt"], n["afmt"]) for n in chunk])
+        return
+
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        pending = deque()
+        for chunk in row_chunks:
+            pending.append((chunk, pool.submit(_render, [
+                (n["values"], n["keys"], n["qfmt"], n["afmt"]) for n in chunk
+            ])))
+
+            if len(pending) >= workers * 2:
+                chunk, future = pending.popleft()
+                yield chunk, future.result()
+
+        while pending:
+            chunk, future = pending.popleft()
+            yield chunk, future.result()
+
+
+@functools.lru_cache(maxsize=512)
+def _empty_front(qfmt: str) -> str:
+    return ankiMustache(qfmt)
+
+
+def _render(rows: List[tuple]) -> List[Optional[Tuple[str, str]]]:
+    """
+    md5 of the front and back of `(values, keys, qfmt, afmt)` rows; or None, if the front renders the same as
+    the template without data.
+    """
+    output = []
+    for values, keys, qfmt, afmt in rows:
+        data = [dict(key=k, value=v) for k, v in zip(keys.split("\x1f"), values.split("\x1f"))]
+
+        front = ankiMustache(qfmt, data)
+        if front == _empty_front(qfmt):
+            output.append(None)
+            continue
+
+        back = ankiMustache(afmt, data, front)
+        output.append((hashlib.md5(front.encode()).hexdigest(), hashlib.md5(back.encode()).hexdigest()))
+
+    return output
@@ -1,212 +1,347 @@
 import sqlite3
-from typing import List, Iterable, Optional, Union
+from typing import List, Dict, Iterable, Iterator, Optional, Union, Any, Callable
 import json
 from datetime import datetime
 import hashlib
 import dataclasses as dc
-
-from .typing import IEntry, IStat, IStreak, ICondOptions, IParserResult, IPagedOutput
-from .util import ankiMustache
+import itertools
+from random import shuffle
+import functools
+import threading
+import queue
+from contextlib import contextmanager
+from pathlib import Path
+from collections import OrderedDict
+import traceback
+
+from .typing import IEntry, IStat, ICondOptions, IParserResult, IPagedOutput
+from .util import ankiMustache, LruCache, chunks, toEpoch
 from .quiz import srsMap, getNextReview, repeatReview
-from .search import mongo_filter, sorter
+from .search import CardRow, mongo_filter, sort_page, encode_cursor, decode_cursor
+from .sql import cond_to_sql, sort_to_sql, seek_to_sql, register_functions
+from .migrate import migrate, has_fts, deferred_fts, fts_index, index_note_fields
+from .scheduler import DueQueue
+
+
+def _statColumns(stat: Union[dict, IStat, None]) -> dict:
+    """
+    `stat` as the card columns; streak counters have their own columns, and any other key stays as JSON.
+    """
+    if stat is None:
+        return {"streakRight": 0, "streakWrong": 0, "stat": None}
+    if dc.is_dataclass(stat):
+        stat = dc.asdict(stat)
+
+    stat = dict(stat)
+    streak = stat.pop("streak", None) or dict()
+
+    return {
+        "streakRight": streak.get("right") or 0,
+        "streakWrong": streak.get("wrong") or 0,
+        "stat": json.dumps(stat, ensure_ascii=False) if stat else None
+    }
+
+
+def _writer(fn: Callable) -> Callable:
+    @functools.wraps(fn)
+    def wrapper(self: "Db", *args, **kwargs):
+        with self.writeLock:
+            # Queued answers go first, so that they do not overwrite later edits.
+            self.flushAnswers()
+            try:
+                return fn(self, *args, **kwargs)
+            except BaseException:
+                # Half-done work must not be committed by the next write; and the due queue,
+                # which may have seen it, is rebuilt on next use.
+                self.conn.rollback()
+                self.dueQueue = None
+                raise
+
+    return wrapper
 
 
 class Db:
-    def __init__(self, filename: str):
+    _FROM = """
+        FROM card AS c
+        INNER JOIN deck AS d ON d.id = deckId
+        LEFT JOIN template AS t ON t.id = templateId
+        LEFT JOIN note AS n ON n.id = noteId
+        LEFT JOIN source AS s ON s.id = n.sourceId
+    """
+
+    def __init__(self, filename: str, renderCacheSize: int = 1024, readerPoolSize: int = 4,
+                 answerFlushInterval: float = 0, answerFlushSize: int = 100):
+        self.renderCache = LruCache(renderCacheSize)
+
+        # The only connection that writes; writes are serialized on writeLock.
         self.conn = sqlite3.connect(filename, check_same_thread=False)
         self.conn.row_factory = sqlite3.Row
-        self.conn.executescript("""
-        CREATE TABLE IF NOT EXISTS deck (
-            id      INTEGER PRIMARY KEY AUTOINCREMENT,
-            name    VARCHAR UNIQUE NOT NULL
-        );
-        CREATE TABLE IF NOT EXISTS source (
-            id          INTEGER PRIMARY KEY AUTOINCREMENT,
-            name        VARCHAR NOT NULL /* NOT UNIQUE */,
-            h           VARCHAR UNIQUE,
-            created     VARCHAR NOT NULL
-        );
-        CREATE TABLE IF NOT EXISTS template (
-            id          INTEGER PRIMARY KEY AUTOINCREMENT,
-            sourceId    INTEGER REFERENCES source(id),
-            name        VARCHAR,
-            model       VARCHAR,
-            front       VARCHAR NOT NULL,
-            back        VARCHAR,
-            css         VARCHAR,
-            js          VARCHAR,
-            UNIQUE (sourceId, name, model)
-        );
-        CREATE TABLE IF NOT EXISTS note (
-            id          INTEGER PRIMARY KEY AUTOINCREMENT,
-            sourceId    INTEGER REFERENCES source(id),
-            key         VARCHAR,
-            data        VARCHAR NOT NULL /* JSON */,
-            UNIQUE (sourceId, key)
-        );
-        CREATE TABLE IF NOT EXISTS media (
-            id          INTEGER PRIMARY KEY AUTOINCREMENT,
-            sourceId    INTEGER REFERENCES source(id),
-            name        VARCHAR NOT NULL,
-            data        BLOB NOT NULL,
-            h           VARCHAR NOT NULL
-        );
-        CREATE TABLE IF NOT EXISTS card (
-            id          INTEGER PRIMARY KEY AUTOINCREMENT,
-            deckId      INTEGER NOT NULL REFERENCES deck(id),
-            templateId  INTEGER REFERENCES template(id),
-            noteId      INTEGER REFERENCES note(id),
-            front       VARCHAR NOT NULL,
-            back        VARCHAR,
-            mnemonic    VARCHAR,
-            srsLevel    INTEGER,
-            nextReview  VARCHAR,
-            /* tag */
-            created     VARCHAR,
-            modified    VARCHAR,
-            stat        VARCHAR
-        );
-        CREATE TABLE IF NOT EXISTS tag (
-            id      INTEGER PRIMARY KEY AUTOINCREMENT,
-            name    VARCHAR UNIQUE NOT NULL
-        );
-        CREATE TABLE IF NOT EXISTS cardTag (
-            cardId  INTEGER NOT NULL REFERENCES card(id) ON DELETE CASCADE,
-            tagId   INTEGER NOT NULL REFERENCES tag(id) ON DELETE CASCADE,
-            PRIMARY KEY (cardId, tagId)
-        );
-        """)
+        self.writeLock = threading.RLock()
+        register_functions(self.conn)
+        migrate(self.conn)
+        self.hasFts = has_fts(self.conn)
+
+        # In WAL mode, readers do not wait for the writer, and see the last commit.
+        self.readerUri = None
+        self.readerPool = queue.LifoQueue(readerPoolSize)
+        if self.conn.execute("PRAGMA journal_mode = WAL").fetchone()[0] == "wal":
+            self.conn.execute("PRAGMA synchronous = NORMAL")
+            if readerPoolSize > 0:
+                self.readerUri = Path(filename).resolve().as_uri() + "?mode=ro"
+
+        # Write-behind for review answers: if answerFlushInterval (in seconds) is set, answers are queued in memory
+        # and written in one transaction every answerFlushInterval, or every answerFlushSize cards.
+        # Queued answers may be lost on a crash, but not on close().
+        self.answerFlushInterval = answerFlushInterval
+        self.answerFlushSize = answerFlushSize
+        self.pendingAnswers = OrderedDict()
+        self.pendingRevlog = []
+        self.closing = threading.Event()
+        if answerFlushInterval:
+            threading.Thread(target=self._flushLoop, daemon=True).start()
+
+        self.dueQueue: Optional[DueQueue] = None
 
     def close(self):
+        self.closing.set()
+        try:
+            self.flushAnswers()
+        except sqlite3.Error:
+            traceback.print_exc()
+
+        while True:
+            try:
+                self.readerPool.get_nowait().close()
+            except queue.Empty:
+                break
+
         try:
             self.conn.commit()
             self.conn.close()
         except sqlite3.Error:
             pass
 
-    def insertMany(self, entries: List[IEntry]) -> List[int]:
-        entries = [IEntry(**self.transformCreateOrUpdate(None, u)) for u in entries]
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """
+        Read-only connection from the pool, or else the writer connection, which must not be shared between threads
+        (Python functions in a query may deadlock with another thread on the same connection).
+        """
+        if self.readerUri is None:
+            with self.writeLock:
+                yield self.conn
+            return
 
-        deckNameToId = dict()
-        for deck in set(e.deck for e in entries):
-            deckNameToId[deck] = self.getOrCreateDeck(deck)
+        try:
+            conn = self.readerPool.get_nowait()
+        except queue.Empty:
+            conn = sqlite3.connect(self.readerUri, uri=True, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            register_functions(conn)
 
-        sourceHToId = dict()
-        sourceSet = set()
+        try:
+            yield conn
+        finally:
+            try:
+                self.readerPool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def insertMany(self, entries: Iterable[Union[dict, IEntry]], chunkSize: int = 1000) -> List[int]:
+        """
+        Entries are inserted and committed `chunkSize` at a time; related ids are resolved once per chunk.
+        """
+        cardIds = []
+        for chunk in chunks(entries, chunkSize):
+            chunk = [self._toEntryDict(u) for u in chunk]
+
+            with self.writeLock:
+                try:
+                    ids = self._insertChunk(chunk)
+                    self.conn.commit()
+                except BaseException:
+                    self.conn.rollback()
+                    raise
+
+                if ids:
+                    self._refreshDueQueue("id >= ?", (ids[0],))
+                cardIds.extend(ids)
+
+        return cardIds
+
+    def _toEntryDict(self, u: Union[dict, IEntry]) -> dict:
+        u = dc.asdict(u) if dc.is_dataclass(u) else dict(u)
+        u["data"] = [dc.asdict(d) if dc.is_dataclass(d) else d for d in (u.get("data") or [])]
+        u = self.transformCreateOrUpdate(None, u)
+
+        u.update(_statColumns(u.get("stat")))
+
+        for k in ["nextReview", "created", "modified"]:
+            u[k] = toEpoch(u.get(k))
+
+        u["sH"] = u.get("sH") or u.get("sourceH")
+        u["sCreated"] = u.get("sCreated") or u.get("sourceCreated")
+
+        return u
+
+    def _insertChunk(self, entries: List[dict]) -> List[int]:
+        deckNameToId = self._getOrCreateIds("deck", set(e["deck"] for e in entries))
+        tagNameToId = self._getOrCreateIds("tag", set(t for e in entries for t in (e.get("tag") or [])))
+
+        sources = dict()
         for e in entries:
-            if e.sH and e.sH not in sourceSet:
-                self.conn.execute("""
-                INSERT INTO source (name, created, h)
-                VALUES (?, ?, ?)
-                ON CONFLICT DO NOTHING
-                """, (e.source, e.sCreated, e.sH))
+            if e.get("sH") and e["sH"] not in sources:
+                sources[e["sH"]] = (e.get("source"), e.get("sCreated"), e["sH"])
 
-                sourceHToId[e.sH] = self.conn.execute("""
-                SELECT id FROM source
-                WHERE h = ?
-                """, (e.sH,)).fetchone()[0]
+        self.conn.executemany("""
+        INSERT INTO source (name, created, h)
+        VALUES (?, ?, ?)
+        ON CONFLICT DO NOTHING
+        """, sources.values())
 
-                sourceSet.add(e.sH)
+        sourceHToId = dict()
+        for hs in chunks(sources.keys(), 500):
+            sourceHToId.update((r[0], r[1]) for r in self.conn.execute(f"""
+            SELECT h, id FROM source
+            WHERE h IN ({",".join(["?"] * len(hs))})
+            """, hs))
+
+        for e in entries:
+            e["sourceId"] = sourceHToId.get(e.get("sH"))
 
         templateKeyToId = dict()
         for e in entries:
-            if e.tFront and e.template and e.model:
-                if e.tFront:
+            tKey = (e["sourceId"], e.get("template"), e.get("model"))
+            if e.get("template") and e.get("model") and tKey not in templateKeyToId:
+                if e.get("tFront"):
                     self.conn.execute("""
                     INSERT INTO template (name, model, front, back, css, js, sourceId)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                    ON CONFLICT DO NOTHING
+                    SELECT ?, ?, ?, ?, ?, ?, ?
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM template WHERE sourceId IS ? AND name = ? AND model = ?
+                    )
                     """, (
-                        e.template,
-                        e.model,
-                        e.tFront,
-                        e.tBack,
-                        e.css,
-                        e.js,
-                        sourceHToId.get(e.sH)
+                        e["template"], e["model"], e["tFront"], e.get("tBack"), e.get("css"), e.get("js"), e["sourceId"],
+                        *tKey
                     ))
 
-                    templateKeyToId[f"{e.template}\x1f{e.model}"] = self.conn.execute("""
-                    SELECT id FROM template
-                    WHERE
-                        sourceId = ? AND
-                        name = ? AND
-                        model = ?
-                    """, (sourceHToId.get(e.sH), e.template, e.model)).fetchone()[0]
+                r = self.conn.execute("""
+                SELECT id FROM template
+                WHERE sourceId IS ? AND name = ? AND model = ?
+                """, tKey).fetchone()
+                templateKeyToId[tKey] = r[0] if r else None
 
-        noteKeyToId = dict()
+        notes = dict()
         for e in entries:
-            if e.data and e.key:
-                try:
-                    noteId = self.conn.execute("""
-                    INSERT INTO note (sourceId, key, data)
-                    VALUES (?, ?, ?)
-                    """, (
-                        sourceHToId.get(e.sH),
-                        e.key,
-                        json.dumps(e.data, ensure_ascii=False)
-                    )).lastrowid
-                except sqlite3.Error:
-                    noteId = self.conn.execute("""
-                    SELECT id FROM note
-                    WHERE
-                        sourceId = ? AND
-                        key = ?
-                    """, (sourceHToId.get(e.sH), e.key)).fetchone()[0]
-
-                noteKeyToId[e.key] = noteId
+            if e.get("data") and e.get("key"):
+                notes.setdefault((e["sourceId"], e["key"]), e["data"])
+
+        noteKeyToId = self._getNoteIds(notes.keys())
+        startNoteId = self.conn.execute("SELECT IFNULL(MAX(id), 0) FROM note").fetchone()[0]
+        self.conn.executemany("""
+        INSERT INTO note (sourceId, key, data)
+        VALUES (?, ?, ?)
+        """, ((*nKey, json.dumps(data, ensure_ascii=False))
+              for nKey, data in notes.items() if nKey not in noteKeyToId))
+        noteKeyToId.update(self._getNoteIds(nKey for nKey in notes.keys() if nKey not in noteKeyToId))
+        index_note_fields(self.conn, "id > ?", (startNoteId,))
+
+        # executemany() cannot report lastrowid, so ids are allocated here, honoring AUTOINCREMENT.
+        startId = self.conn.execute("""
+        SELECT MAX(
+            IFNULL((SELECT seq FROM sqlite_sequence WHERE name = 'card'), 0),
+            IFNULL((SELECT MAX(id) FROM card), 0)
+        )
+        """).fetchone()[0]
+        cardIds = list(range(startId + 1, startId + 1 + len(entries)))
 
-        now = str(datetime.now())
-        cardIds = []
-        for e in entries:
-            cardId = int(self.conn.execute("""
+        with deferred_fts(self.conn, self.hasFts):
+            now = toEpoch(datetime.now())
+            self.conn.executemany("""
             INSERT INTO card
-            (front, back, mnemonic, nextReview, deckId, noteId, templateId, created, srsLevel, stat)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                e.front,
-                e.back,
-                e.mnemonic,
-                e.nextReview,
-                deckNameToId.get(e.deck),
-                noteKeyToId.get(e.key),
-                templateKeyToId.get(f"{e.template}\x1f{e.model}"),
+            (id, front, back, mnemonic, nextReview, deckId, noteId, templateId, created, srsLevel,
+             streakRight, streakWrong, stat)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, ((
+                cardId,
+                e["front"],
+                e.get("back"),
+                e.get("mnemonic"),
+                e.get("nextReview"),
+                deckNameToId[e["deck"]],
+                noteKeyToId.get((e["sourceId"], e.get("key"))),
+                templateKeyToId.get((e["sourceId"], e.get("template"), e.get("model"))),
                 now,
-                e.srsLevel,
-                json.dumps(dc.asdict(e.stat), ensure_ascii=False)
-            )).lastrowid)
+                e.get("srsLevel"),
+                e["streakRight"],
+                e["streakWrong"],
+                e["stat"]
+            ) for cardId, e in zip(cardIds, entries)))
 
-            if e.tag:
-                for t in e.tag:
-                    self.conn.execute("""
-                    INSERT INTO tag (name)
-                    VALUES (?)
-                    ON CONFLICT DO NOTHING
-                    """, (t,))
+            self.conn.executemany("""
+            INSERT INTO cardTag (cardId, tagId)
+            VALUES (?, ?)
+            ON CONFLICT DO NOTHING
+            """, ((cardId, tagNameToId[t]) for cardId, e in zip(cardIds, entries) for t in (e.get("tag") or [])))
 
-                    self.conn.execute("""
-                    INSERT INTO cardTag (cardId, tagId)
-                    VALUES (
-                        ?,
-                        (SELECT id FROM tag WHERE name = ?)
-                    )
-                    ON CONFLICT DO NOTHING
-                    """, (cardId, t))
+            if self.hasFts:
+                fts_index(self.conn, "id > ?", (startId,))
+
+        return cardIds
 
-            cardIds.append(cardId)
+    def _getNoteIds(self, noteKeys: Iterable[tuple]) -> dict:
+        noteKeyToId = dict()
+        for sourceId, nKeys in itertools.groupby(sorted(noteKeys, key=lambda k: (k[0] is not None, k)),
+                                                 key=lambda k: k[0]):
+            for ks in chunks((k for _, k in nKeys), 500):
+                noteKeyToId.update(((sourceId, r[0]), r[1]) for r in self.conn.execute(f"""
+                SELECT key, id FROM note
+                WHERE sourceId IS ? AND key IN ({",".join(["?"] * len(ks))})
+                """, (sourceId, *ks)))
+
+        return noteKeyToId
+
+    def _getOrCreateIds(self, table: str, names: Iterable[str]) -> dict:
+        names = list(names)
+        self.conn.executemany(f"""
+        INSERT INTO {table} (name)
+        VALUES (?)
+        ON CONFLICT DO NOTHING
+        """, ((n,) for n in names))
 
-        self.conn.commit()
+        nameToId = dict()
+        for ns in chunks(names, 500):
+            nameToId.update((r[0], r[1]) for r in self.conn.execute(f"""
+            SELECT name, id FROM {table}
+            WHERE name IN ({",".join(["?"] * len(ns))})
+            """, ns))
 
-        return cardIds
+        return nameToId
+
+    def getAll(self, cond: dict = None) -> List[dict]:
+        return list(self.iterAll(cond))
+
+    def iterAll(self, cond: dict = None) -> Iterator[dict]:
+        where, params, residual = cond_to_sql(cond, self.hasFts)
+        return self._iter(where, params, residual)
 
-    def getAll(self) -> List[dict]:
-        c = self.conn.execute("""
+    def _iter(self, where: str, params: List[Any], residual: Optional[dict] = None,
+              orderBy: str = None, offset: int = 0, limit: int = None) -> Iterator[dict]:
+        if residual:
+            residual = mongo_filter(residual)
+
+        sql = f"""
         SELECT
             c.id AS id,
             c.front AS front,
             c.back AS back,
             mnemonic,
-            /* tag */
+            (
+                SELECT json_group_array(tg.name)
+                FROM cardTag AS ct
+                INNER JOIN tag AS tg ON tg.id = ct.tagId
+                WHERE ct.cardId = c.id
+            ) AS tag,
             srsLevel,
             nextReview,
             d.name AS deck,
@@ -223,28 +358,77 @@ class Db:
             s.name AS source,
             s.h AS sourceH,
             s.created AS sourceCreated,
+            streakRight,
+            streakWrong,
             stat
-        FROM card AS c
-        INNER JOIN deck AS d ON d.id = deckId
-        LEFT JOIN template AS t ON t.id = templateId
-        LEFT JOIN note AS n ON n.id = noteId
-        LEFT JOIN source AS s ON s.id = n.sourceId
-        """)
+        {self._FROM}
+        WHERE {where}
+        """
+        if orderBy:
+            sql += f"ORDER BY {orderBy}\n"
+        if limit is not None:
+            sql += f"LIMIT {int(limit)} OFFSET {int(offset)}\n"
+
+        if self.pendingAnswers:
+            self.flushAnswers()
+
+        with self.reader() as conn:
+            for r in conn.execute(sql, params):
+                item = CardRow(r)
+                item["tag"] = json.loads(item["tag"])
+                item["data"] = json.loads(item["data"] if item["data"] else "null")
+                item["stat"] = {
+                    "streak": {"right": item.pop("streakRight"), "wrong": item.pop("streakWrong")},
+                    **json.loads(item["stat"] or "{}")
+                }
+
+                if residual is None or residual(item):
+                    yield item
+
+    def _count(self, where: str, params: List[Any]) -> int:
+        if self.pendingAnswers:
+            self.flushAnswers()
+
+        with self.reader() as conn:
+            return conn.execute(f"""
+            SELECT COUNT(*)
+            {self._FROM}
+            WHERE {where}
+            """, params).fetchone()[0]
+
+    def countByDeck(self, cond: dict = None, now: datetime = None) -> Dict[str, dict]:
+        """
+        New, leech and due cards per deck (not including subdecks), among the cards matching cond.
+        """
+        if now is None:
+            now = datetime.now()
+
+        where, params, residual = cond_to_sql(cond, self.hasFts)
+
+        if residual:
+            output = dict()
+            for c in self._iter(where, params, residual):
+                stat = output.setdefault(c["deck"], dict(new=0, leech=0, due=0))
+                stat["new"] += c.get("nextReview") is None
+                stat["leech"] += c.get("srsLevel") == 0
+                stat["due"] += c.get("nextReview") is not None and c["nextReview"] < toEpoch(now)
+
+            return output
 
-        items = []
-        for r in c:
-            item = dict(r)
-            item["tag"] = [x[0] for x in self.conn.execute("""
-            SELECT name
-            FROM tag
-            INNER JOIN cardTag AS ct ON ct.tagId = tag.id
-            WHERE ct.cardId = ?
-            """, (item["id"],))]
-            item["data"] = json.loads(item["data"] if item["data"] else "null")
-            item["stat"] = json.loads(item["stat"] if item["stat"] else "null")
-            items.append(item)
-
-        return items
+        if self.pendingAnswers:
+            self.flushAnswers()
+
+        with self.reader() as conn:
+            return {r["deck"]: dict(new=r["new"], leech=r["leech"], due=r["due"]) for r in conn.execute(f"""
+            SELECT
+                d.name AS deck,
+                SUM(nextReview IS NULL) AS new,
+                SUM(IFNULL(srsLevel = 0, 0)) AS leech,
+                SUM(IFNULL(nextReview < ?, 0)) AS due
+            {self._FROM}
+            WHERE {where}
+            GROUP BY d.name
+            """, [toEpoch(now), *params])}
 
     def getOrCreateDeck(self, name: str) -> int:
         self.conn.execute("""
@@ -258,6 +442,86 @@ class Db:
         WHERE name = ?
         """, (name,)).fetchone()[0]
 
+    @_writer
+    def renameDeck(self, old: str, new: str):
+        """
+        Renames deck `old` and its subdecks to `new`, merging into the decks that already exist there.
+        """
+        if new == old:
+            return
+        if new.startswith(old + "/"):
+            raise ValueError(f"Cannot move {old} into its own subdeck")
+
+        try:
+            # Every deck of the subtree, and the deck it merges into, if its new name is taken by a deck outside
+            # the subtree; names inside it are all freed, by merging or renaming.
+            self.conn.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS tempDeckMove (
+                id          INTEGER PRIMARY KEY,
+                targetId    INTEGER
+            )
+            """)
+            self.conn.execute("DELETE FROM tempDeckMove")
+            self.conn.execute("""
+            INSERT INTO tempDeckMove (id, targetId)
+            SELECT a.deckId, d1.id
+            FROM deckAncestor AS a
+            INNER JOIN deck AS d ON d.id = a.deckId
+            LEFT JOIN deck AS d1 ON d1.name = ? || substr(d.name, ?)
+                AND d1.id NOT IN (SELECT deckId FROM deckAncestor WHERE ancestor = ?)
+            WHERE a.ancestor = ?
+            """, (new, len(old) + 1, old, old))
+
+            with deferred_fts(self.conn, self.hasFts):
+                self.conn.execute("""
+                UPDATE card
+                SET deckId = (SELECT targetId FROM tempDeckMove WHERE id = card.deckId)
+                WHERE deckId IN (SELECT id FROM tempDeckMove WHERE targetId IS NOT NULL)
+                """)
+
+                if self.hasFts:
+                    fts_index(self.conn, "deckId IN (SELECT targetId FROM tempDeckMove)")
+
+            self.conn.execute("""
+            INSERT INTO revlogDaily (date, deckId, nReview, nRight, nNew, duration, nDuration)
+            SELECT date, m.targetId, nReview, nRight, nNew, duration, nDuration
+            FROM revlogDaily AS r
+            INNER JOIN tempDeckMove AS m ON m.id = r.deckId
+            WHERE m.targetId IS NOT NULL
+            ON CONFLICT (date, deckId) DO UPDATE SET
+                nReview = nReview + excluded.nReview,
+                nRight = nRight + excluded.nRight,
+                nNew = nNew + excluded.nNew,
+                duration = duration + excluded.duration,
+                nDuration = nDuration + excluded.nDuration
+            """)
+            self.conn.execute("""
+            DELETE FROM revlogDaily
+            WHERE deckId IN (SELECT id FROM tempDeckMove WHERE targetId IS NOT NULL)
+            """)
+            self.conn.execute("""
+            DELETE FROM deck
+            WHERE id IN (SELECT id FROM tempDeckMove WHERE targetId IS NOT NULL)
+            """)
+
+            # Shallower first, as moving up, a deck takes the name of one deeper in the subtree.
+            self.conn.executemany("""
+            UPDATE deck
+            SET name = ? || substr(name, ?)
+            WHERE id = ?
+            """, [(new, len(old) + 1, r[0]) for r in self.conn.execute("""
+            SELECT id FROM deck
+            WHERE id IN (SELECT id FROM tempDeckMove WHERE targetId IS NULL)
+            ORDER BY length(name)
+            """).fetchall()])
+
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
+
+        self._refreshDueQueue("deckId IN (SELECT targetId FROM tempDeckMove)")
+
     def transformCreateOrUpdate(self, cId: Optional[int] = None, u: Union[dict, IEntry] = None) -> dict:
         if u is None:
             u = dict()
@@ -265,7 +529,7 @@ class Db:
         data = None
         front = None
 
-        if u.get("front", "").startswith("@template\n"):
+        if (u.get("front") or "").startswith("@template\n"):
             if data is None:
                 if cId is not None:
                     data = self.getData(cId)
@@ -273,11 +537,14 @@ class Db:
                     data = u.get("data", list())
             u["tFront"] = u.pop("front")[len("@template\n"):]
 
+        if data is None and cId is None:
+            data = u.get("data")
+
         if u.get("tFront"):
             front = ankiMustache(u["tFront"], data)
             u["front"] = "@md5\n" + hashlib.md5(front.encode()).hexdigest()
 
-        if u.get("back", "").startswith("@template\n"):
+        if (u.get("back") or "").startswith("@template\n"):
             u["tBack"] = u.pop("back")[len("@template\n"):]
             if front is None:
                 if cId is not None:
@@ -291,12 +558,14 @@ class Db:
 
         return u
 
+    @_writer
     def update(self, cId: int, u: dict = None, doCommit: bool = True):
         if u is None:
             u = dict()
 
         u = self.transformCreateOrUpdate(cId, u)
-        u["modified"] = str(datetime.now())
+        u["modified"] = datetime.now()
+        self.renderCache.pop(cId)
 
         for k, v in u.items():
             if k == "deck":
@@ -310,7 +579,9 @@ class Db:
                 "nextReview", "created", "modified",
                 "front", "back", "mnemonic", "srsLevel"
             }:
-                if not isinstance(v, (str, int, float)):
+                if k in {"nextReview", "created", "modified"}:
+                    v = toEpoch(v)
+                elif not isinstance(v, (str, int, float)):
                     v = str(v)
 
                 self.conn.execute(f"""
@@ -335,16 +606,15 @@ class Db:
                 )
                 """, (v, cId))
             elif k == "tag":
-                prevTags = self.getTags(cId)
-                self.addTags(cId, [t for t in v if t not in prevTags], False, prevTags)
-                self.removeTags(cId, [t for t in prevTags if t not in v], False, prevTags)
+                self._setTempCardIds([cId])
+                self._setTags(v)
             elif k == "stat":
-                v = json.dumps(v, ensure_ascii=False)
+                cols = _statColumns(v)
                 self.conn.execute(f"""
                 UPDATE card
-                SET stat = ?
+                SET {", ".join(f"{k0} = ?" for k0 in cols.keys())}
                 WHERE id = ?
-                """, (v, cId))
+                """, (*cols.values(), cId))
             elif k == "data":
                 data = self.getData(cId)
 
@@ -361,12 +631,13 @@ class Db:
 
                 if self.conn.execute("""
                 SELECT noteId FROM card WHERE card.id = ?
-                """, (cId,)).fetchone() is None:
+                """, (cId,)).fetchone()[0] is None:
 
                     noteId = self.conn.execute("""
                     INSERT INTO note (data)
                     VALUES (?)
-                    """, (json.dumps(data, ensure_ascii=False)))
+                    """, (json.dumps(data, ensure_ascii=False),)).lastrowid
+                    index_note_fields(self.conn, "id = ?", (noteId,))
 
                     self.conn.execute("""
                     UPDATE card
@@ -381,18 +652,119 @@ class Db:
                         SELECT noteId FROM card WHERE card.id = ?
                     )
                     """, (json.dumps(data, ensure_ascii=False), cId))
+                    index_note_fields(self.conn, "id = (SELECT noteId FROM card WHERE card.id = ?)", (cId,))
 
         if doCommit:
             self.conn.commit()
 
+        if "deck" in u or "nextReview" in u:
+            self._refreshDueQueue("id = ?", (cId,))
+
+    @_writer
     def updateMany(self, cIds: List[int], u: dict = None):
         if u is None:
             u = dict()
 
-        for cId in cIds:
-            self.update(cId, u, False)
+        perCard = dict()
+        for k in ["front", "back"]:
+            if str(u.get(k, "")).startswith("@template\n"):
+                perCard[k] = u[k]
+        for k in ["tFront", "tBack", "data"]:
+            if k in u:
+                perCard[k] = u[k]
 
-        self.conn.commit()
+        reindex = self.hasFts and any(k in u for k in ["front", "back", "mnemonic", "deck", "tag"])
+
+        try:
+            self._setTempCardIds(cIds)
+            with deferred_fts(self.conn, reindex):
+                cols = {"modified": toEpoch(datetime.now())}
+                for k, v in u.items():
+                    if k in perCard:
+                        continue
+
+                    if k == "deck":
+                        cols["deckId"] = self.getOrCreateDeck(v)
+                    elif k in {
+                        "nextReview", "created", "modified",
+                        "front", "back", "mnemonic", "srsLevel"
+                    }:
+                        if k in {"nextReview", "created", "modified"}:
+                            v = toEpoch(v)
+                        elif not isinstance(v, (str, int, float)):
+                            v = str(v)
+
+                        cols[k] = v
+                    elif k == "stat":
+                        cols.update(_statColumns(v))
+                    elif k in {"css", "js"}:
+                        self.conn.execute(f"""
+                        UPDATE template
+                        SET {k} = ?
+                        WHERE id IN (
+                            SELECT templateId FROM card WHERE id IN (SELECT id FROM tempCardIds)
+                        )
+                        """, (v,))
+                    elif k == "tag":
+                        self._setTags(v)
+
+                self.conn.execute(f"""
+                UPDATE card
+                SET {", ".join(f"{k} = ?" for k in cols.keys())}
+                WHERE id IN (SELECT id FROM tempCardIds)
+                """, list(cols.values()))
+
+                if reindex:
+                    fts_index(self.conn, "id IN (SELECT id FROM tempCardIds)")
+
+            for cId in cIds:
+                self.renderCache.pop(cId)
+                if perCard:
+                    self.update(cId, dict(perCard), False)
+
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
+
+        if "deckId" in cols or "nextReview" in cols:
+            self._refreshDueQueue("id IN (SELECT id FROM tempCardIds)")
+
+    def _setTempCardIds(self, cIds: Iterable[int]):
+        self.conn.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS tempCardIds (
+            id  INTEGER PRIMARY KEY
+        )
+        """)
+        self.conn.execute("DELETE FROM tempCardIds")
+        self.conn.executemany("""
+        INSERT OR IGNORE INTO tempCardIds (id)
+        VALUES (?)
+        """, ((cId,) for cId in cIds))
+
+    def _setTags(self, tags: Iterable[str]):
+        """
+        Replaces the tags of every card in `tempCardIds`.
+        """
+        tagIds = list(self._getOrCreateIds("tag", set(tags)).values())
+        self.conn.execute(f"""
+        DELETE FROM cardTag
+        WHERE
+            cardId IN (SELECT id FROM tempCardIds) AND
+            tagId NOT IN ({",".join(["?"] * len(tagIds))})
+        """, tagIds)
+        self._insertCardTags(tagIds)
+
+    def _insertCardTags(self, tagIds: List[int]):
+        """
+        Tags every card in `tempCardIds`.
+        """
+        self.conn.executemany("""
+        INSERT INTO cardTag (cardId, tagId)
+        SELECT id, ? FROM tempCardIds
+        WHERE true
+        ON CONFLICT DO NOTHING
+        """, ((tagId,) for tagId in tagIds))
 
     def getFront(self, cId: int) -> str:
         front = self.conn.execute("""
@@ -415,25 +787,39 @@ class Db:
         return front
 
     def getData(self, cId: int) -> List[dict]:
-        return json.loads(self.conn.execute("""
+        r = self.conn.execute("""
         SELECT data FROM note
         WHERE note.id = (SELECT noteId FROM card WHERE card.id = ?)
-        """, (cId,)).fetchone()[0])
+        """, (cId,)).fetchone()
+
+        return json.loads(r[0]) if r else []
 
+    @_writer
     def delete(self, cId: int):
+        self.renderCache.pop(cId)
         self.conn.execute("""
         DELETE FROM card
         WHERE id = ?
         """, (cId,))
         self.conn.commit()
 
+        if self.dueQueue is not None:
+            self.dueQueue.remove([cId])
+
+    @_writer
     def deleteMany(self, cIds: List[int]):
+        for cId in cIds:
+            self.renderCache.pop(cId)
+
         self.conn.execute(f"""
         DELETE FROM card
         WHERE id IN ({",".join(["?"] * len(cIds))})
         """, cIds)
         self.conn.commit()
 
+        if self.dueQueue is not None:
+            self.dueQueue.remove(cIds)
+
     def getTags(self, cId: int):
         return set(c[0] for c in self.conn.execute("""
         SELECT name
@@ -443,51 +829,60 @@ class Db:
         WHERE c.id = ?
         """, (cId,)))
 
-    def addTags(self, cId: int, tags: Iterable[str], doCommit: bool = True, prevTags: Iterable[str] = None):
-        if prevTags is None:
-            prevTags = []
-
-        for t in tags:
-            if t not in prevTags:
-                self.conn.execute("""
-                INSERT INTO tag (name)
-                VALUES (?)
-                ON CONFLICT DO NOTHING
-                """, (t,))
-
-                self.conn.execute("""
-                INSERT INTO cardTag (cardId, tagId)
-                VALUES (
-                    ?,
-                    (SELECT tag.id FROM tag WHERE tag.name = ?)
-                )
-                ON CONFLICT DO NOTHING
-                """, (cId, t))
-
-        self.update(cId, None, False)
+    @_writer
+    def addTags(self, cIds: List[int], tags: Iterable[str], doCommit: bool = True):
+        try:
+            self._setTempCardIds(cIds)
+            self._editTags(lambda: self._insertCardTags(list(self._getOrCreateIds("tag", set(tags)).values())))
 
-        if doCommit:
-            self.conn.commit()
+            if doCommit:
+                self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
 
-    def removeTags(self, cId: int, tags: Iterable[str], doCommit: bool = True, prevTags: Iterable[str] = None):
-        if prevTags is None:
-            prevTags = []
+    @_writer
+    def removeTags(self, cIds: List[int], tags: Iterable[str], doCommit: bool = True):
+        tags = list(set(tags))
 
-        for t in prevTags:
-            if t in tags:
-                self.conn.execute("""
-                DELETE FROM cardTag
-                WHERE
-                    cardId = ? AND
-                    tagId = (SELECT id FROM tag WHERE name = ?)
-                """, (cId, t))
+        try:
+            self._setTempCardIds(cIds)
+            self._editTags(lambda: self.conn.execute(f"""
+            DELETE FROM cardTag
+            WHERE
+                cardId IN (SELECT id FROM tempCardIds) AND
+                tagId IN (SELECT id FROM tag WHERE name IN ({",".join(["?"] * len(tags))}))
+            """, tags))
+
+            if doCommit:
+                self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
+
+    def _editTags(self, fn: Callable[[], Any]):
+        """
+        Runs `fn` on the cards of `tempCardIds`, with FTS maintenance deferred to one pass, and bumps `modified`.
+        """
+        with deferred_fts(self.conn, self.hasFts):
+            fn()
+
+            if self.hasFts:
+                fts_index(self.conn, "id IN (SELECT id FROM tempCardIds)")
 
-        self.update(cId, None, False)
+        self.conn.execute("""
+        UPDATE card
+        SET modified = ?
+        WHERE id IN (SELECT id FROM tempCardIds)
+        """, (toEpoch(datetime.now()),))
 
-        if doCommit:
-            self.conn.commit()
+        for r in self.conn.execute("SELECT id FROM tempCardIds"):
+            self.renderCache.pop(r[0])
 
     def parseCond(self, cond: IParserResult, options: ICondOptions = None) -> IPagedOutput:
+        if options is None:
+            options = ICondOptions()
+
         def _filter_fields(entry: dict) -> dict:
             if options.fields is None:
                 return entry
@@ -505,45 +900,79 @@ class Db:
         elif options.sortBy:
             sortBy = options.sortBy
 
-        if sortBy:
-            if cond.desc is not None:
-                desc = cond.desc
-            else:
-                desc = options.desc
-
-            sortKey = sorter(sortBy, desc)
+        if cond.desc is not None:
+            desc = cond.desc
         else:
-            sortKey = None
+            desc = options.desc
+
+        after = None
+        if options.cursor and sortBy != "random":
+            after = decode_cursor(options.cursor, sortBy, desc)
+
+        # One more row than the page, to tell whether there is a next one
+        limit = options.limit + 1 if options.limit else None
 
-        allCards = sorted((c for c in self.getAll() if mongo_filter(cond.cond)(c)), key=sortKey)
-        if options.limit:
-            endPoint = options.offset + options.limit
+        where, params, residual = cond_to_sql(cond.cond, self.hasFts)
+        orderBy = sort_to_sql(sortBy, desc)
+
+        if residual is None and orderBy:
+            count = self._count(where, params)
+
+            if after is not None:
+                w, p = seek_to_sql(sortBy, desc, *after)
+                where = f"{where} AND {w}"
+                params = params + p
+
+            if limit:
+                data = list(self._iter(where, params, None, orderBy, options.offset, limit))
+            else:
+                data = list(itertools.islice(self._iter(where, params, None, orderBy), options.offset, None))
         else:
-            endPoint = None
+            data = self._iter(where, params, residual, "c.id")
+            if sortBy == "random":
+                data = list(data)
+                shuffle(data)
+
+            data, count = sort_page(data, sortBy if sortBy != "random" else None, desc,
+                                    options.offset, limit, after)
+
+        cursor = None
+        if limit and len(data) == limit:
+            data = data[:options.limit]
+            if sortBy != "random":
+                cursor = encode_cursor(sortBy, desc, data[-1])
 
         return IPagedOutput(
-            data=[_filter_fields(c) for c in allCards[options.offset: endPoint]],
-            count=len(allCards)
+            data=[_filter_fields(c) for c in data],
+            count=count,
+            cursor=cursor
         )
 
     def render(self, cardId: int) -> dict:
-        c = dict(self.conn.execute("""
-        SELECT
-            c.front AS front,
-            c.back AS back,
-            mnemonic,
-            t.name AS template,
-            t.model AS model,
-            t.front AS tFront,
-            t.back AS tBack,
-            css,
-            js,
-            n.data AS data
-        FROM card AS c
-        LEFT JOIN template AS t ON t.id = templateId
-        LEFT JOIN note AS n ON n.id = noteId
-        WHERE c.id = ?
-        """, (cardId,)).fetchone())
+        with self.reader() as conn:
+            c = dict(conn.execute("""
+            SELECT
+                c.front AS front,
+                c.back AS back,
+                mnemonic,
+                t.name AS template,
+                t.model AS model,
+                t.front AS tFront,
+                t.back AS tBack,
+                css,
+                js,
+                n.data AS data
+            FROM card AS c
+            LEFT JOIN template AS t ON t.id = templateId
+            LEFT JOIN note AS n ON n.id = noteId
+            WHERE c.id = ?
+            """, (cardId,)).fetchone())
+
+        # The source row is the state, so that edits through shared templates and notes are also seen.
+        state = tuple(c.values())
+        cached = self.renderCache.get(cardId, state)
+        if cached is not None:
+            return dict(cached)
 
         c["data"] = json.loads(c["data"] if c["data"] else "null")
 
@@ -553,48 +982,183 @@ class Db:
         if c["back"] and c["back"].startswith("@md5\n"):
             c["back"] = ankiMustache(c.get("tBack", ""), c.get("data", list()), c["front"])
 
-        return c
+        self.renderCache.set(cardId, c, state)
 
-    def markRight(self, cardId: int):
-        return self._updateCard(+1, cardId)
+        return dict(c)
 
-    def markWrong(self, cardId: int):
-        return self._updateCard(-1, cardId)
+    def markRight(self, cardId: int, duration: Optional[int] = None):
+        return self._updateCard(+1, cardId, duration)
 
-    def _updateCard(self, dSrsLevel: int, cardId: int):
-        srsLevel, stat = self.conn.execute("""
-        SELECT srsLevel, stat FROM card WHERE id = ?""", (cardId,)).fetchone()
+    def markWrong(self, cardId: int, duration: Optional[int] = None):
+        return self._updateCard(-1, cardId, duration)
 
-        if stat is None:
-            stat = IStat(
-                streak=IStreak(right=0, wrong=0)
-            )
-        else:
-            stat = EasyDict(**json.loads(stat))
-
-        if srsLevel is None:
-            srsLevel = 0
+    def _updateCard(self, dSrsLevel: int, cardId: int, duration: Optional[int] = None):
+        with self.writeLock:
+            if cardId in self.pendingAnswers:
+                srsLevel, streakRight, streakWrong = self.pendingAnswers[cardId][:3]
+            else:
+                srsLevel, streakRight, streakWrong = self.conn.execute("""
+                SELECT srsLevel, streakRight, streakWrong FROM card WHERE id = ?""", (cardId,)).fetchone()
 
-        if dSrsLevel > 0:
-            stat["streak"]["right"] = stat.setdefault("streak", dict()).setdefault("right", 0) + 1
-        elif dSrsLevel < 0:
-            stat["streak"]["wrong"] = stat.setdefault("streak", dict()).setdefault("wrong", 0) + 1
+            prevSrsLevel = srsLevel
+            if srsLevel is None:
+                srsLevel = 0
 
-        srsLevel += dSrsLevel
+            if dSrsLevel > 0:
+                streakRight += 1
+            elif dSrsLevel < 0:
+                streakWrong += 1
 
-        if srsLevel >= len(srsMap):
-            srsLevel = len(srsMap) - 1
+            srsLevel += dSrsLevel
 
-        if srsLevel < 0:
-            srsLevel = 0
+            if srsLevel >= len(srsMap):
+                srsLevel = len(srsMap) - 1
 
-        if dSrsLevel > 0:
-            nextReview = getNextReview(srsLevel)
-        else:
-            nextReview = repeatReview()
+            if srsLevel < 0:
+                srsLevel = 0
 
-        self.update(cardId, {
-            "srsLevel": srsLevel,
-            "stat": stat,
-            "nextReview": nextReview
-        })
+            if dSrsLevel > 0:
+                nextReview = getNextReview(srsLevel)
+            else:
+                nextReview = repeatReview()
+
+            now = toEpoch(datetime.now())
+            nextReview = toEpoch(nextReview)
+            answer = (srsLevel, streakRight, streakWrong, nextReview, now)
+            review = (cardId, now, 1 if dSrsLevel > 0 else -1, prevSrsLevel, srsLevel,
+                      int(duration) if duration is not None else None)
+
+            if self.answerFlushInterval:
+                self.pendingAnswers[cardId] = answer
+                self.pendingAnswers.move_to_end(cardId)
+                self.pendingRevlog.append(review)
+            else:
+                try:
+                    self._writeAnswers([(cardId, answer)], [review])
+                    self.conn.commit()
+                except BaseException:
+                    self.conn.rollback()
+                    raise
+
+            # Once committed, or queued, as queued answers are read as stored; a failed flush keeps them queued.
+            if self.dueQueue is not None:
+                self.dueQueue.setNextReview(cardId, nextReview)
+
+            if self.answerFlushInterval and len(self.pendingAnswers) >= self.answerFlushSize:
+                self.flushAnswers()
+
+    def flushAnswers(self):
+        with self.writeLock:
+            if not self.pendingAnswers:
+                return
+
+            try:
+                self._writeAnswers(self.pendingAnswers.items(), self.pendingRevlog)
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                raise
+
+            self.pendingAnswers.clear()
+            self.pendingRevlog.clear()
+
+    def _writeAnswers(self, answers: Iterable[tuple], reviews: Iterable[tuple]):
+        self.conn.executemany("""
+        UPDATE card
+        SET srsLevel = ?, streakRight = ?, streakWrong = ?, nextReview = ?, modified = ?
+        WHERE id = ?
+        """, ((*answer, cardId) for cardId, answer in answers))
+        # revlogDaily is kept up to date by a trigger on revlog.
+        self.conn.executemany("""
+        INSERT INTO revlog (cardId, created, answer, prevSrsLevel, srsLevel, duration)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """, reviews)
+
+    def reviewStats(self, deck: Optional[str] = None,
+                    since: Optional[str] = None, until: Optional[str] = None) -> List[dict]:
+        """
+        Reviews per day, from the daily rollups; optionally for a deck and its subdecks,
+        and for dates (YYYY-MM-DD, inclusive) between since and until.
+        """
+        where = ["TRUE"]
+        params = []
+        if deck:
+            where.append("deckId IN (SELECT deckId FROM deckAncestor WHERE ancestor = ?)")
+            params.append(deck)
+        if since:
+            where.append("date >= ?")
+            params.append(since[:10])
+        if until:
+            where.append("date <= ?")
+            params.append(until[:10])
+
+        if self.pendingAnswers:
+            self.flushAnswers()
+
+        with self.reader() as conn:
+            return [dict(
+                r,
+                retention=r["nRight"] / r["nReview"],
+                averageDuration=r["duration"] / r["nDuration"] if r["nDuration"] else None
+            ) for r in conn.execute(f"""
+            SELECT
+                date,
+                SUM(nReview) AS nReview,
+                SUM(nRight) AS nRight,
+                SUM(nNew) AS nNew,
+                SUM(duration) AS duration,
+                SUM(nDuration) AS nDuration
+            FROM revlogDaily
+            WHERE {" AND ".join(where)}
+            GROUP BY date
+            ORDER BY date
+            """, params)]
+
+    def getDueQueue(self) -> DueQueue:
+        """
+        Built from the collection on first use, then kept up to date by writes through `Db`.
+        """
+        with self.writeLock:
+            if self.dueQueue is None:
+                self.flushAnswers()
+                dueQueue = DueQueue()
+                dueQueue.load(self.conn.execute("SELECT id, deckId, nextReview FROM card"))
+                self.dueQueue = dueQueue
+
+            return self.dueQueue
+
+    def _refreshDueQueue(self, where: str, params: Iterable[Any] = ()):
+        if self.dueQueue is not None:
+            self.dueQueue.load(self.conn.execute(f"""
+            SELECT id, deckId, nextReview FROM card WHERE {where}
+            """, list(params)))
+
+    def getDue(self, deck: Optional[str] = None, until: Optional[datetime] = None,
+               includeNew: bool = False, limit: Optional[int] = None) -> List[int]:
+        """
+        Cards of a deck and its subdecks (or of every deck) due by `until`, most overdue first;
+        then, if `includeNew`, new cards, by id.
+        """
+        dueQueue = self.getDueQueue()
+
+        deckIds = None
+        if deck is not None:
+            with self.reader() as conn:
+                deckIds = [r[0] for r in conn.execute("""
+                SELECT deckId FROM deckAncestor WHERE ancestor = ?
+                """, (deck,))]
+
+        output = []
+        if until is not None:
+            output = dueQueue.due(deckIds, toEpoch(until), limit)
+        if includeNew and (limit is None or len(output) < limit):
+            output.extend(dueQueue.newCards(deckIds, limit - len(output) if limit is not None else None))
+
+        return output
+
+    def _flushLoop(self):
+        while not self.closing.wait(self.answerFlushInterval):
+            try:
+                self.flushAnswers()
+            except sqlite3.Error:
+                traceback.print_exc()
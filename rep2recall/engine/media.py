@@ -0,0 +1,59 @@
+"""
+Content-addressed media: a file is keyed by its md5, `media.h`. Files of up to `INLINE_SIZE` bytes are kept
+in `media.data`; larger ones are written to the media folder, at `blob_path`, and `media.data` is NULL.
+"""
+import hashlib
+import os
+from pathlib import Path
+from tempfile import mkstemp
+from typing import BinaryIO, Optional, Tuple, Union
+
+INLINE_SIZE = 1 << 14
+CHUNK_SIZE = 1 << 20
+
+
+def blob_path(folder: Union[str, Path], h: str) -> Path:
+    """
+    Sharded by the first two bytes of the hash, so that no directory gets too large
+    """
+    return Path(folder).joinpath(".blob", h[:2], h[2:4], h)
+
+
+def store(f: BinaryIO, size: int, folder: Union[str, Path, None]) -> Tuple[str, Optional[bytes]]:
+    """
+    Reads `f`, `CHUNK_SIZE` at a time, hashing as it goes; returns the md5, and the data if it is kept inline
+    (always, if `folder` is None). A larger file is written to a temporary file, then moved to `blob_path`,
+    unless a file of the same hash is already there.
+    """
+    h = hashlib.md5()
+
+    if folder is None or size <= INLINE_SIZE:
+        parts = []
+        for b in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(b)
+            parts.append(b)
+
+        return h.hexdigest(), b"".join(parts)
+
+    tmp_dir = Path(folder).joinpath(".blob")
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    fd, tmp = mkstemp(dir=str(tmp_dir), suffix=".tmp")
+
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for b in iter(lambda: f.read(CHUNK_SIZE), b""):
+                h.update(b)
+                out.write(b)
+
+        path = blob_path(folder, h.hexdigest())
+        if path.exists():
+            os.unlink(tmp)
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp, str(path))
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+    return h.hexdigest(), None
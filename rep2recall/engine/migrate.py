@@ -0,0 +1,564 @@
+import json
+import re
+import sqlite3
+from contextlib import contextmanager
+from typing import List, Union, Callable, Iterable, Iterator, Any, Optional
+
+
+def _fts_insert(where: str) -> str:
+    return f"""
+    INSERT INTO cardFts (rowid, front, back, mnemonic, deck, tag, template, data)
+    SELECT
+        c.id,
+        c.front,
+        c.back,
+        c.mnemonic,
+        d.name,
+        (
+            SELECT group_concat(tg.name, char(10))
+            FROM cardTag AS ct
+            INNER JOIN tag AS tg ON tg.id = ct.tagId
+            WHERE ct.cardId = c.id
+        ),
+        t.name,
+        (SELECT group_concat(json_extract(f.value, '$.value'), char(10)) FROM json_each(n.data) AS f)
+    FROM card AS c
+    INNER JOIN deck AS d ON d.id = c.deckId
+    LEFT JOIN template AS t ON t.id = c.templateId
+    LEFT JOIN note AS n ON n.id = c.noteId
+    WHERE c.id IN (SELECT id FROM card WHERE {where})
+    """
+
+
+def _fts_refresh(where: str) -> str:
+    return f"""
+    DELETE FROM cardFts WHERE rowid IN (SELECT id FROM card WHERE {where});
+    {_fts_insert(where)};
+    """
+
+
+def _create_fts(conn: sqlite3.Connection):
+    try:
+        conn.execute("""
+        CREATE VIRTUAL TABLE cardFts USING fts5(
+            front, back, mnemonic, deck, tag, template, data,
+            tokenize = 'trigram'
+        )
+        """)
+    except sqlite3.OperationalError:
+        # SQLite without FTS5, or older than 3.34 (no trigram tokenizer); search falls back to scanning.
+        return
+
+    for stmt in [
+        f"""
+        CREATE TRIGGER t_card_insert_fts AFTER INSERT ON card BEGIN
+            {_fts_refresh("id = new.id")}
+        END
+        """,
+        f"""
+        CREATE TRIGGER t_card_update_fts AFTER UPDATE OF front, back, mnemonic, deckId, templateId, noteId ON card
+        BEGIN
+            {_fts_refresh("id = new.id")}
+        END
+        """,
+        """
+        CREATE TRIGGER t_card_delete_fts AFTER DELETE ON card BEGIN
+            DELETE FROM cardFts WHERE rowid = old.id;
+        END
+        """,
+        f"""
+        CREATE TRIGGER t_cardTag_insert_fts AFTER INSERT ON cardTag BEGIN
+            {_fts_refresh("id = new.cardId")}
+        END
+        """,
+        f"""
+        CREATE TRIGGER t_cardTag_delete_fts AFTER DELETE ON cardTag BEGIN
+            {_fts_refresh("id = old.cardId")}
+        END
+        """,
+        f"""
+        CREATE TRIGGER t_deck_update_fts AFTER UPDATE OF name ON deck BEGIN
+            {_fts_refresh("deckId = new.id")}
+        END
+        """,
+        f"""
+        CREATE TRIGGER t_template_update_fts AFTER UPDATE OF name ON template BEGIN
+            {_fts_refresh("templateId = new.id")}
+        END
+        """,
+        f"""
+        CREATE TRIGGER t_note_update_fts AFTER UPDATE OF data ON note BEGIN
+            {_fts_refresh("noteId = new.id")}
+        END
+        """
+    ]:
+        conn.execute(stmt)
+
+    conn.execute(_fts_insert("1"))
+
+
+def _create_fts_deferred(conn: sqlite3.Connection):
+    if not has_fts(conn):
+        return
+
+    conn.execute("""
+    CREATE TABLE ftsDeferred (
+        id  INTEGER PRIMARY KEY
+    )
+    """)
+
+    for name, event, refresh in [
+        ("t_card_insert_fts", "INSERT ON card", _fts_refresh("id = new.id")),
+        ("t_card_update_fts", "UPDATE OF front, back, mnemonic, deckId, templateId, noteId ON card",
+         _fts_refresh("id = new.id")),
+        ("t_cardTag_insert_fts", "INSERT ON cardTag", _fts_refresh("id = new.cardId")),
+        ("t_cardTag_delete_fts", "DELETE ON cardTag", _fts_refresh("id = old.cardId"))
+    ]:
+        conn.execute(f"DROP TRIGGER {name}")
+        conn.execute(f"""
+        CREATE TRIGGER {name} AFTER {event}
+        WHEN NOT EXISTS (SELECT 1 FROM ftsDeferred)
+        BEGIN
+            {refresh}
+        END
+        """)
+
+
+def _deck_ancestors(deck: str, table: str = None) -> str:
+    """
+    Rows of (ancestor, deckId) for the deck row `deck`, where ancestors are the deck name itself and
+    each of its `/`-prefixes, whether or not they have a deck row. (CTEs are not allowed in triggers.)
+    """
+    return f"""
+    SELECT
+        substr({deck}.name, 1, (
+            SELECT SUM(length(s.value)) + f.key
+            FROM json_each('[' || replace(json_quote({deck}.name), '/', '","') || ']') AS s
+            WHERE s.key <= f.key
+        )),
+        {deck}.id
+    FROM {table + " AS " + deck + ", " if table else ""}json_each('[' || replace(json_quote({deck}.name), '/', '","') || ']') AS f
+    """
+
+
+def _epoch_dates(conn: sqlite3.Connection):
+    """
+    card.nextReview, created, modified and revlog.created, from `str(datetime)` in local time, to Unix time
+    in seconds. Column types cannot be altered, so both tables are rebuilt, with their ids, indexes and triggers.
+    """
+    def _epoch(col: str) -> str:
+        return f"CAST(strftime('%s', {col}, 'utc') AS INTEGER)"
+
+    for table, create, select in [
+        ("card", """
+        CREATE TABLE card_new (
+            id          INTEGER PRIMARY KEY AUTOINCREMENT,
+            deckId      INTEGER NOT NULL REFERENCES deck(id),
+            templateId  INTEGER REFERENCES template(id),
+            noteId      INTEGER REFERENCES note(id),
+            front       VARCHAR NOT NULL,
+            back        VARCHAR,
+            mnemonic    VARCHAR,
+            srsLevel    INTEGER,
+            nextReview  INTEGER /* Unix time */,
+            /* tag */
+            created     INTEGER /* Unix time */,
+            modified    INTEGER /* Unix time */,
+            stat        VARCHAR
+        )
+        """, f"""
+        SELECT
+            id, deckId, templateId, noteId, front, back, mnemonic, srsLevel,
+            {_epoch("nextReview")}, {_epoch("created")}, {_epoch("modified")}, stat
+        FROM card
+        """),
+        ("revlog", """
+        CREATE TABLE revlog_new (
+            id              INTEGER PRIMARY KEY AUTOINCREMENT,
+            cardId          INTEGER NOT NULL /* not a foreign key; history outlives cards */,
+            created         INTEGER NOT NULL /* Unix time */,
+            answer          INTEGER NOT NULL /* +1 right, -1 wrong */,
+            prevSrsLevel    INTEGER /* NULL if new */,
+            srsLevel        INTEGER NOT NULL,
+            duration        INTEGER /* response time, in ms */
+        )
+        """, f"""
+        SELECT id, cardId, {_epoch("created")}, answer, prevSrsLevel, srsLevel, duration
+        FROM revlog
+        """)
+    ]:
+        dependents = [r[0] for r in conn.execute("""
+        SELECT sql FROM sqlite_master
+        WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL AND name <> 't_revlog_insert_daily'
+        """, (table,))]
+        seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+
+        conn.execute(create)
+        conn.execute(f"INSERT INTO {table}_new {select}")
+        conn.execute(f"DROP TABLE {table}")
+        # Otherwise, triggers of other tables, which refer to the dropped table, fail the rename.
+        conn.execute("PRAGMA legacy_alter_table = ON")
+        conn.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+        conn.execute("PRAGMA legacy_alter_table = OFF")
+
+        # Ids of deleted rows are not reused.
+        if seq is not None:
+            conn.execute("UPDATE sqlite_sequence SET seq = max(seq, ?) WHERE name = ?", (seq[0], table))
+
+        for sql in dependents:
+            conn.execute(sql)
+
+    conn.execute("""
+    CREATE TRIGGER t_revlog_insert_daily AFTER INSERT ON revlog BEGIN
+        INSERT INTO revlogDaily (date, deckId, nReview, nRight, nNew, duration, nDuration)
+        VALUES (
+            date(new.created, 'unixepoch', 'localtime'),
+            IFNULL((SELECT deckId FROM card WHERE id = new.cardId), 0),
+            1,
+            new.answer > 0,
+            new.prevSrsLevel IS NULL,
+            IFNULL(new.duration, 0),
+            new.duration IS NOT NULL
+        )
+        ON CONFLICT (date, deckId) DO UPDATE SET
+            nReview = nReview + excluded.nReview,
+            nRight = nRight + excluded.nRight,
+            nNew = nNew + excluded.nNew,
+            duration = duration + excluded.duration,
+            nDuration = nDuration + excluded.nDuration;
+    END
+    """)
+
+
+def _media_by_hash(conn: sqlite3.Connection):
+    """
+    Media, deduplicated by hash, which is made unique; and `data` made nullable, for files kept in the media folder.
+    Links of templates to a dropped duplicate, i.e. `/media/<id>`, are pointed to the kept one.
+    """
+    kept = dict(conn.execute("""
+    SELECT m.id, (SELECT MIN(m1.id) FROM media AS m1 WHERE m1.h = m.h) AS keptId
+    FROM media AS m
+    WHERE keptId <> m.id
+    """).fetchall())
+
+    if kept:
+        def _relink(s: Optional[str]) -> Optional[str]:
+            if s is None:
+                return None
+
+            return re.sub(r"/media/(\d+)", lambda m: f"/media/{kept.get(int(m[1]), m[1])}", s)
+
+        conn.executemany("""
+        UPDATE template SET front = ?, back = ?, css = ? WHERE id = ?
+        """, [(_relink(front), _relink(back), _relink(css), tId) for tId, front, back, css in conn.execute("""
+        SELECT id, front, back, css FROM template
+        WHERE instr(front, '/media/') OR instr(back, '/media/') OR instr(css, '/media/')
+        """).fetchall()])
+
+    seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'media'").fetchone()
+
+    conn.execute("""
+    CREATE TABLE media_new (
+        id          INTEGER PRIMARY KEY AUTOINCREMENT,
+        sourceId    INTEGER REFERENCES source(id),
+        name        VARCHAR NOT NULL,
+        data        BLOB /* NULL if stored in the media folder */,
+        h           VARCHAR UNIQUE NOT NULL /* md5 */
+    )
+    """)
+    conn.execute("""
+    INSERT INTO media_new (id, sourceId, name, data, h)
+    SELECT id, sourceId, name, data, h FROM media
+    WHERE id IN (SELECT MIN(id) FROM media GROUP BY h)
+    """)
+    conn.execute("DROP TABLE media")
+    conn.execute("ALTER TABLE media_new RENAME TO media")
+
+    if seq is not None:
+        conn.execute("UPDATE sqlite_sequence SET seq = max(seq, ?) WHERE name = 'media'", (seq[0],))
+
+
+def _note_fields(conn: sqlite3.Connection):
+    """
+    note.data, as an indexed `(noteId, lowerKey, value)` table. Keys are lowercased in Python, as `data_getter` does.
+    """
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS noteField (
+        noteId      INTEGER NOT NULL REFERENCES note(id),
+        lowerKey    VARCHAR NOT NULL,
+        value,
+        PRIMARY KEY (noteId, lowerKey)
+    ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_noteField_lowerKey_value ON noteField (lowerKey, value)")
+    index_note_fields(conn, "1")
+
+
+def _reindex_fts_deferred(conn: sqlite3.Connection):
+    """
+    A failed tag edit could leave FTS triggers deferred, and have it committed by the next write;
+    the index may then be stale, and is rebuilt.
+    """
+    if not has_fts(conn) or conn.execute("SELECT 1 FROM ftsDeferred").fetchone() is None:
+        return
+
+    conn.execute("DELETE FROM ftsDeferred")
+    conn.execute("DELETE FROM cardFts")
+    conn.execute(_fts_insert("1"))
+
+
+# Append only. The position in the list (1-based) is the schema version, stored in `PRAGMA user_version`.
+MIGRATIONS: List[Union[str, Callable[[sqlite3.Connection], None]]] = [
+    """
+    CREATE TABLE IF NOT EXISTS deck (
+        id      INTEGER PRIMARY KEY AUTOINCREMENT,
+        name    VARCHAR UNIQUE NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS source (
+        id          INTEGER PRIMARY KEY AUTOINCREMENT,
+        name        VARCHAR NOT NULL /* NOT UNIQUE */,
+        h           VARCHAR UNIQUE,
+        created     VARCHAR NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS template (
+        id          INTEGER PRIMARY KEY AUTOINCREMENT,
+        sourceId    INTEGER REFERENCES source(id),
+        name        VARCHAR,
+        model       VARCHAR,
+        front       VARCHAR NOT NULL,
+        back        VARCHAR,
+        css         VARCHAR,
+        js          VARCHAR,
+        UNIQUE (sourceId, name, model)
+    );
+    CREATE TABLE IF NOT EXISTS note (
+        id          INTEGER PRIMARY KEY AUTOINCREMENT,
+        sourceId    INTEGER REFERENCES source(id),
+        key         VARCHAR,
+        data        VARCHAR NOT NULL /* JSON */,
+        UNIQUE (sourceId, key)
+    );
+    CREATE TABLE IF NOT EXISTS media (
+        id          INTEGER PRIMARY KEY AUTOINCREMENT,
+        sourceId    INTEGER REFERENCES source(id),
+        name        VARCHAR NOT NULL,
+        data        BLOB NOT NULL,
+        h           VARCHAR NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS card (
+        id          INTEGER PRIMARY KEY AUTOINCREMENT,
+        deckId      INTEGER NOT NULL REFERENCES deck(id),
+        templateId  INTEGER REFERENCES template(id),
+        noteId      INTEGER REFERENCES note(id),
+        front       VARCHAR NOT NULL,
+        back        VARCHAR,
+        mnemonic    VARCHAR,
+        srsLevel    INTEGER,
+        nextReview  VARCHAR,
+        /* tag */
+        created     VARCHAR,
+        modified    VARCHAR,
+        stat        VARCHAR
+    );
+    CREATE TABLE IF NOT EXISTS tag (
+        id      INTEGER PRIMARY KEY AUTOINCREMENT,
+        name    VARCHAR UNIQUE NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS cardTag (
+        cardId  INTEGER NOT NULL REFERENCES card(id) ON DELETE CASCADE,
+        tagId   INTEGER NOT NULL REFERENCES tag(id) ON DELETE CASCADE,
+        PRIMARY KEY (cardId, tagId)
+    );
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_card_nextReview ON card (nextReview);
+    CREATE INDEX IF NOT EXISTS idx_card_deckId ON card (deckId);
+    CREATE INDEX IF NOT EXISTS idx_card_srsLevel ON card (srsLevel);
+    CREATE INDEX IF NOT EXISTS idx_card_noteId ON card (noteId);
+    CREATE INDEX IF NOT EXISTS idx_cardTag_tagId ON cardTag (tagId);
+    CREATE INDEX IF NOT EXISTS idx_note_sourceId ON note (sourceId);
+    CREATE INDEX IF NOT EXISTS idx_media_h ON media (h);
+    """,
+    _create_fts,
+    _create_fts_deferred,
+    """
+    CREATE TABLE IF NOT EXISTS revlog (
+        id              INTEGER PRIMARY KEY AUTOINCREMENT,
+        cardId          INTEGER NOT NULL /* not a foreign key; history outlives cards */,
+        created         VARCHAR NOT NULL,
+        answer          INTEGER NOT NULL /* +1 right, -1 wrong */,
+        prevSrsLevel    INTEGER /* NULL if new */,
+        srsLevel        INTEGER NOT NULL,
+        duration        INTEGER /* response time, in ms */
+    );
+    CREATE INDEX IF NOT EXISTS idx_revlog_cardId ON revlog (cardId);
+    CREATE TABLE IF NOT EXISTS revlogDaily (
+        date        VARCHAR NOT NULL /* YYYY-MM-DD, local time */,
+        deckId      INTEGER NOT NULL,
+        nReview     INTEGER NOT NULL,
+        nRight      INTEGER NOT NULL,
+        nNew        INTEGER NOT NULL,
+        duration    INTEGER NOT NULL /* ms, over the reviews with a duration */,
+        nDuration   INTEGER NOT NULL,
+        PRIMARY KEY (date, deckId)
+    );
+    CREATE TRIGGER IF NOT EXISTS t_revlog_insert_daily AFTER INSERT ON revlog BEGIN
+        INSERT INTO revlogDaily (date, deckId, nReview, nRight, nNew, duration, nDuration)
+        VALUES (
+            substr(new.created, 1, 10),
+            IFNULL((SELECT deckId FROM card WHERE id = new.cardId), 0),
+            1,
+            new.answer > 0,
+            new.prevSrsLevel IS NULL,
+            IFNULL(new.duration, 0),
+            new.duration IS NOT NULL
+        )
+        ON CONFLICT (date, deckId) DO UPDATE SET
+            nReview = nReview + excluded.nReview,
+            nRight = nRight + excluded.nRight,
+            nNew = nNew + excluded.nNew,
+            duration = duration + excluded.duration,
+            nDuration = nDuration + excluded.nDuration;
+    END;
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS deckAncestor (
+        ancestor    VARCHAR NOT NULL,
+        deckId      INTEGER NOT NULL REFERENCES deck(id) ON DELETE CASCADE,
+        PRIMARY KEY (ancestor, deckId)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_deckAncestor_deckId ON deckAncestor (deckId);
+    INSERT OR IGNORE INTO deckAncestor (ancestor, deckId) {_deck_ancestors("d", "deck")};
+    CREATE TRIGGER IF NOT EXISTS t_deck_insert_ancestor AFTER INSERT ON deck BEGIN
+        INSERT OR IGNORE INTO deckAncestor (ancestor, deckId) {_deck_ancestors("new")};
+    END;
+    CREATE TRIGGER IF NOT EXISTS t_deck_update_ancestor AFTER UPDATE OF name ON deck BEGIN
+        DELETE FROM deckAncestor WHERE deckId = old.id;
+        INSERT OR IGNORE INTO deckAncestor (ancestor, deckId) {_deck_ancestors("new")};
+    END;
+    CREATE TRIGGER IF NOT EXISTS t_deck_delete_ancestor AFTER DELETE ON deck BEGIN
+        DELETE FROM deckAncestor WHERE deckId = old.id;
+    END;
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_card_deckId_nextReview ON card (deckId, nextReview);
+    DROP INDEX IF EXISTS idx_card_deckId;
+    """,
+    _epoch_dates,
+    """
+    ALTER TABLE card ADD COLUMN streakRight INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE card ADD COLUMN streakWrong INTEGER NOT NULL DEFAULT 0;
+    UPDATE card SET
+        streakRight = IFNULL(json_extract(stat, '$.streak.right'), 0),
+        streakWrong = IFNULL(json_extract(stat, '$.streak.wrong'), 0),
+        stat = NULLIF(json_remove(stat, '$.streak'), '{}')
+    WHERE json_valid(stat);
+    CREATE INDEX IF NOT EXISTS idx_card_streakRight ON card (streakRight);
+    CREATE INDEX IF NOT EXISTS idx_card_streakWrong ON card (streakWrong);
+    """,
+    _note_fields,
+    _media_by_hash,
+    _reindex_fts_deferred
+]
+
+
+def has_fts(conn: sqlite3.Connection) -> bool:
+    return conn.execute("""
+    SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'cardFts'
+    """).fetchone() is not None
+
+
+@contextmanager
+def deferred_fts(conn: sqlite3.Connection, deferred: bool = True) -> Iterator[None]:
+    """
+    Skips the per-row FTS triggers of card and cardTag within the block, which must not commit.
+    Affected cards must then be reindexed with `fts_index`. The triggers are back on when the block exits,
+    even if it raises, so that a later commit cannot leave them off.
+    """
+    if not deferred:
+        yield
+        return
+
+    conn.execute("INSERT OR IGNORE INTO ftsDeferred (id) VALUES (1)")
+    try:
+        yield
+    finally:
+        conn.execute("DELETE FROM ftsDeferred")
+
+
+def fts_index(conn: sqlite3.Connection, where: str, params: Iterable[Any] = ()):
+    params = list(params)
+    conn.execute(f"""
+    DELETE FROM cardFts WHERE rowid IN (SELECT id FROM card WHERE {where})
+    """, params)
+    conn.execute(_fts_insert(where), params)
+
+
+def index_note_fields(conn: sqlite3.Connection, where: str, params: Iterable[Any] = ()):
+    """
+    Rebuilds `noteField` of the notes matching `where`. Only the first field of a key is kept, as in `data_getter`.
+    """
+    params = list(params)
+    conn.execute(f"""
+    DELETE FROM noteField WHERE noteId IN (SELECT id FROM note WHERE {where})
+    """, params)
+    conn.executemany("""
+    INSERT OR IGNORE INTO noteField (noteId, lowerKey, value)
+    VALUES (?, ?, ?)
+    """, [(noteId, k, v) for noteId, data in conn.execute(f"""
+    SELECT id, data FROM note WHERE {where}
+    """, params) for k, v in _note_field_items(data)])
+
+
+def _note_field_items(data: str) -> Iterable[tuple]:
+    try:
+        data = json.loads(data)
+    except (ValueError, TypeError):
+        return
+
+    for f in data if isinstance(data, list) else []:
+        if isinstance(f, dict) and isinstance(f.get("key"), str):
+            v = f.get("value")
+            # As `json_extract` gives them
+            if isinstance(v, (dict, list)):
+                v = json.dumps(v, ensure_ascii=False)
+
+            yield f["key"].lower(), v
+
+
+def get_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection, target: int = None) -> int:
+    if target is None:
+        target = len(MIGRATIONS)
+
+    version = get_version(conn)
+    if version > len(MIGRATIONS):
+        raise ValueError(f"Collection schema version {version} is newer than supported ({len(MIGRATIONS)})")
+
+    conn.commit()
+
+    while version < target:
+        m = MIGRATIONS[version]
+        version += 1
+
+        if isinstance(m, str):
+            conn.executescript(f"""
+            BEGIN;
+            {m}
+            PRAGMA user_version = {version};
+            COMMIT;
+            """)
+        else:
+            try:
+                conn.execute("BEGIN")
+                m(conn)
+                conn.execute(f"PRAGMA user_version = {version}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    return version
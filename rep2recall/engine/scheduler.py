@@ -0,0 +1,127 @@
+import heapq
+import threading
+from typing import Dict, List, Iterable, Iterator, Optional, Tuple
+
+
+class DueQueue:
+    """
+    Resident index of cards by deck, for building quizzes without scanning the collection:
+    a heap of `(nextReview, cardId)` per deck for scheduled cards, and a set per deck for new cards.
+
+    Heap entries are superseded lazily; an entry is live only if it matches `cards[cardId]`.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cards: Dict[int, Tuple[int, Optional[int]]] = dict()
+        self.heaps: Dict[int, List[Tuple[int, int]]] = dict()
+        self.new: Dict[int, Dict[int, None]] = dict()
+        self.nStale = 0
+
+    def load(self, rows: Iterable[tuple]):
+        """
+        Sets `(cardId, deckId, nextReview)` rows.
+        """
+        with self.lock:
+            for cardId, deckId, nextReview in rows:
+                self._set(cardId, deckId, nextReview)
+
+    def setNextReview(self, cardId: int, nextReview: Optional[int]):
+        with self.lock:
+            if cardId in self.cards:
+                self._set(cardId, self.cards[cardId][0], nextReview)
+
+    def remove(self, cardIds: Iterable[int]):
+        with self.lock:
+            for cardId in cardIds:
+                if cardId in self.cards:
+                    self._drop(cardId, *self.cards.pop(cardId))
+
+    def due(self, deckIds: Optional[Iterable[int]], until: int, limit: Optional[int] = None) -> List[int]:
+        """
+        Cards of `deckIds` (or of every deck) with `nextReview <= until`, most overdue first.
+        """
+        output = []
+        with self.lock:
+            for cardId in self._iterDue(deckIds, until):
+                if limit is not None and len(output) >= limit:
+                    break
+                output.append(cardId)
+
+        return output
+
+    def newCards(self, deckIds: Optional[Iterable[int]], limit: Optional[int] = None) -> List[int]:
+        with self.lock:
+            if deckIds is None:
+                deckIds = self.new.keys()
+            cardIds = (cId for deckId in set(deckIds) for cId in self.new.get(deckId, ()))
+            if limit is not None:
+                return heapq.nsmallest(limit, cardIds)
+
+            return sorted(cardIds)
+
+    def _set(self, cardId: int, deckId: int, nextReview: Optional[int]):
+        current = (deckId, nextReview)
+        previous = self.cards.get(cardId)
+        if previous == current:
+            return
+
+        if previous is not None:
+            self._drop(cardId, *previous)
+
+        self.cards[cardId] = current
+        if nextReview is None:
+            self.new.setdefault(deckId, dict())[cardId] = None
+        else:
+            heapq.heappush(self.heaps.setdefault(deckId, []), (nextReview, cardId))
+
+    def _drop(self, cardId: int, deckId: int, nextReview: Optional[int]):
+        if nextReview is None:
+            self.new[deckId].pop(cardId, None)
+            return
+
+        self.nStale += 1
+        if self.nStale > len(self.cards):
+            self._compact()
+
+    def _compact(self):
+        self.heaps = dict()
+        for cardId, (deckId, nextReview) in self.cards.items():
+            if nextReview is not None:
+                self.heaps.setdefault(deckId, []).append((nextReview, cardId))
+
+        for h in self.heaps.values():
+            heapq.heapify(h)
+
+        self.nStale = 0
+
+    def _iterDue(self, deckIds: Optional[Iterable[int]], until: int) -> Iterator[int]:
+        """
+        Walks the heaps of `deckIds` from their roots, in `(nextReview, cardId)` order,
+        so that taking k cards costs O(k log n), rather than a scan.
+        """
+        if deckIds is None:
+            deckIds = self.heaps.keys()
+
+        frontier = []
+        for deckId in set(deckIds):
+            h = self.heaps.get(deckId)
+            if h:
+                frontier.append((h[0], deckId, 0))
+
+        heapq.heapify(frontier)
+        seen = set()
+
+        while frontier:
+            (nextReview, cardId), deckId, i = heapq.heappop(frontier)
+            if nextReview > until:
+                continue
+
+            h = self.heaps[deckId]
+            for j in (2 * i + 1, 2 * i + 2):
+                if j < len(h):
+                    heapq.heappush(frontier, (h[j], deckId, j))
+
+            if self.cards.get(cardId) == (deckId, nextReview) and cardId not in seen:
+                seen.add(cardId)
+                yield cardId
@@ -1,11 +1,16 @@
 from datetime import datetime, timedelta
 import re
-from typing import Union, Callable, Any
+from typing import Union, Callable, Any, List, Optional, Iterable, Tuple
 import math
 import functools
+import json
+import heapq
+import base64
+from abc import ABC, abstractmethod
 from uuid import uuid4
 
 from .typing import IParserResult
+from .util import toEpoch
 
 ANY_OF = {"template", "front", "mnemonic", "entry", "deck", "tag"}
 IS_DATE = {"created", "modified", "nextReview"}
@@ -88,14 +93,15 @@ class SearchParser:
 
             if q.startswith(kw) and q != kw:
                 self.sort_by = q[len(kw):]
+                self.desc = True
                 return None
 
-            return {"$not": self._parse(q)}
+            return {"$not": self._parse(q[1:])}
 
         raise ValueError("Not negative")
 
     def _parse_full_expr(self, q: str):
-        m = re.fullmatch(r'([\w-]+)(:|~|[><]=?|=)([\w-]+|"[^"]+")', q)
+        m = re.fullmatch(r'(@?[\w.-]+)(:|~|[><]=?|=)([\w-]+|"[^"]+")', q)
         if m:
             k, op, v = m.groups()
 
@@ -110,7 +116,7 @@ class SearchParser:
                 if v == "due":
                     k = "nextReview"
                     op = "<="
-                    v = str(datetime.now())
+                    v = toEpoch(datetime.now())
                 elif v == "leech":
                     k = "srsLevel"
                     op = "="
@@ -141,16 +147,19 @@ class SearchParser:
                     {k: {"$exists": False}}
                 ]}
 
-            if k in IS_DATE:
+            if k in IS_DATE and isinstance(v, str):
                 try:
-                    v = str(datetime.now() + parse_timedelta(v))
+                    v = toEpoch(datetime.now() + parse_timedelta(v))
                     if op == ":":
                         if k == "nextReview":
                             op = "<="
                         else:
                             op = ">="
                 except ValueError:
-                    pass
+                    try:
+                        v = toEpoch(v)
+                    except ValueError:
+                        pass
 
             if op == ":":
                 if isinstance(v, str) or k in IS_STRING:
@@ -190,31 +199,180 @@ class SearchParser:
 def mongo_filter(cond: Union[str, dict]) -> Callable[[dict], bool]:
     if isinstance(cond, str):
         cond = SearchParser().parse(cond).cond
-        return mongo_filter(cond)
-
-    def inner_filter(item: dict) -> bool:
-        for k, v in cond.items():
-            if k[0] == "$":
-                if k == "$and":
-                    return all(mongo_filter(x)(item) for x in v)
-                elif k == "$or":
-                    return any(mongo_filter(x)(item) for x in v)
-                elif k == "$not":
-                    return not mongo_filter(v)(item)
-            else:
-                item_k = dot_getter(item, k)
 
-                if isinstance(v, dict) and any(k0[0] == "$" for k0 in v.keys()):
-                    return _mongo_compare(item_k, v)
-                elif isinstance(item_k, list):
-                    if v not in item_k:
-                        return False
-                elif item_k != v:
-                    return False
+    try:
+        return _compile_cached(_canonical(cond))
+    except TypeError:
+        return compile_filter(cond)
+
+
+def compile_filter(cond: Optional[dict]) -> "Predicate":
+    if not cond:
+        return Const(True)
+
+    preds = []
+    for k, v in cond.items():
+        if k[0] == "$":
+            if k == "$and":
+                return _all(preds + [_all([compile_filter(x) for x in v])])
+            elif k == "$or":
+                return _all(preds + [Any_([compile_filter(x) for x in v])])
+            elif k == "$not":
+                return _all(preds + [Not(compile_filter(v))])
+            elif k == "$deck":
+                return _all(preds + [InDeck(v)])
+        elif isinstance(v, dict) and any(k0[0] == "$" for k0 in v.keys()):
+            return _all(preds + [Compare(field_getter(k), v)])
+        else:
+            preds.append(Equals(field_getter(k), v))
+
+    return _all(preds)
+
+
+def _all(preds: List["Predicate"]) -> "Predicate":
+    return preds[0] if len(preds) == 1 else All(preds)
+
+
+def _canonical(cond: Optional[dict]) -> str:
+    # Key order is kept, as it is significant in `compile_filter`
+    return json.dumps(cond, ensure_ascii=False, separators=(",", ":"))
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_cached(canonical: str) -> "Predicate":
+    return compile_filter(json.loads(canonical))
+
+
+class Predicate(ABC):
+    @abstractmethod
+    def __call__(self, item: dict) -> bool:
+        pass
+
+
+class Const(Predicate):
+    def __init__(self, value: bool):
+        self.value = value
+
+    def __call__(self, item: dict) -> bool:
+        return self.value
+
+
+class All(Predicate):
+    def __init__(self, children: List[Predicate]):
+        self.children = children
+
+    def __call__(self, item: dict) -> bool:
+        return all(c(item) for c in self.children)
+
+
+class Any_(Predicate):
+    def __init__(self, children: List[Predicate]):
+        self.children = children
+
+    def __call__(self, item: dict) -> bool:
+        return any(c(item) for c in self.children)
+
+
+class Not(Predicate):
+    def __init__(self, child: Predicate):
+        self.child = child
 
-        return True
+    def __call__(self, item: dict) -> bool:
+        return not self.child(item)
 
-    return inner_filter
+
+class InDeck(Predicate):
+    """
+    The card's deck is `deck`, or one of its `/`-subdecks.
+    """
+
+    def __init__(self, deck: str):
+        self.deck = str(deck)
+
+    def __call__(self, item: dict) -> bool:
+        d = item.get("deck")
+        return d is not None and (d == self.deck or d.startswith(self.deck + "/"))
+
+
+class Equals(Predicate):
+    def __init__(self, getter: Callable[[dict], Any], value):
+        self.getter = getter
+        self.value = value
+
+    def __call__(self, item: dict) -> bool:
+        item_k = self.getter(item)
+
+        if isinstance(item_k, list):
+            return self.value in item_k
+
+        return item_k == self.value
+
+
+class Compare(Predicate):
+    def __init__(self, getter: Callable[[dict], Any], v_obj: dict):
+        self.getter = getter
+        self.ops = []
+
+        for op, v0 in v_obj.items():
+            if op == "$regex":
+                v0 = re.compile(str(v0), flags=re.IGNORECASE)
+            elif op in {"$substr", "$startswith"}:
+                v0 = str(v0)
+            elif op in {"$gte", "$gt", "$lte", "$lt"}:
+                try:
+                    v0 = (v0, int(v0))
+                except (ValueError, OverflowError):
+                    v0 = (v0, None)
+                except TypeError:
+                    continue
+            elif op != "$exists":
+                continue
+
+            self.ops.append((op, v0))
+
+    def __call__(self, item: dict) -> bool:
+        v = self.getter(item)
+
+        for op, v0 in self.ops:
+            try:
+                if op == "$regex":
+                    if isinstance(v, list):
+                        return any(v0.search(str(b)) for b in v)
+                    else:
+                        return v0.search(str(v)) is not None
+                elif op == "$substr":
+                    if isinstance(v, list):
+                        return any(v0 in str(b) for b in v)
+                    else:
+                        return v0 in str(v)
+                elif op == "$startswith":
+                    if isinstance(v, list):
+                        return any(str(b).startswith(v0) for b in v)
+                    else:
+                        return str(v).startswith(v0)
+                elif op == "$exists":
+                    return (v is not None) == v0
+                else:
+                    v0, int_v0 = v0
+                    try:
+                        int_v = int(v)
+                        if int_v0 is not None:
+                            v, v0 = int_v, int_v0
+                    except ValueError:
+                        pass
+
+                    if op == "$gte":
+                        return v >= v0
+                    elif op == "$gt":
+                        return v > v0
+                    elif op == "$lte":
+                        return v <= v0
+                    elif op == "$lt":
+                        return v < v0
+            except TypeError:
+                pass
+
+        return False
 
 
 def parse_timedelta(s: str) -> timedelta:
@@ -239,71 +397,154 @@ def parse_timedelta(s: str) -> timedelta:
     raise ValueError("Invalid timedelta")
 
 
-def sorter(sort_by: str, desc: bool) -> Callable[[Any], bool]:
-    def pre_cmp(a, b):
-        m = _sort_convert(a)
-        n = _sort_convert(b)
+def sort_key(sort_by: str) -> Callable[[dict], tuple]:
+    getter = field_getter(sort_by, False)
+    return lambda x: sort_value_key(getter(x))
 
-        if isinstance(m, (float, int, str)):
-            if type(m) == type(n):
-                return 1 if m > n else 0 if m == n else -1
-            elif isinstance(m, str):
-                return 1
-            else:
-                return -1
-        else:
-            return 0
 
-    return functools.cmp_to_key(lambda x, y: -pre_cmp(dot_getter(x, sort_by, False), dot_getter(y, sort_by, False))
-        if desc else pre_cmp(dot_getter(x, sort_by, False), dot_getter(y, sort_by, False)))
+def sort_value_key(v: Any) -> tuple:
+    m = _sort_convert(v)
+    # Numbers (and missing values, as -inf) come before strings
+    return (1, m) if isinstance(m, str) else (0, m)
+
+
+def sort_page(items: Iterable[dict], sort_by: Optional[str], desc: bool = False,
+              offset: int = 0, limit: int = None, after: Tuple[Any, int] = None) -> Tuple[List[dict], int]:
+    """
+    Stable sort, then slice; with a `limit`, only the top `offset + limit` are kept while counting.
+    `after` is a decoded cursor, i.e. the sort value and id of the last row of the previous page.
+    """
+    count = 0
+
+    if after is not None:
+        after_key = sort_value_key(after[0]) if sort_by else None
+        after_id = after[1]
+        key = sort_key(sort_by) if sort_by else (lambda x: None)
+
+        def _is_after(x: dict) -> bool:
+            k = key(x)
+            if k == after_key:
+                return x["id"] > after_id
+
+            return k < after_key if desc else k > after_key
+    else:
+        def _is_after(x: dict) -> bool:
+            return True
+
+    def _counted():
+        nonlocal count
+        for x in items:
+            count += 1
+            if _is_after(x):
+                yield x
+
+    if not sort_by:
+        all_items = list(_counted())
+    elif limit is None:
+        all_items = sorted(_counted(), key=sort_key(sort_by), reverse=desc)
+    else:
+        top_k = heapq.nlargest if desc else heapq.nsmallest
+        all_items = top_k(offset + limit, _counted(), key=sort_key(sort_by))
+
+    if limit is None:
+        return all_items[offset:], count
+
+    return all_items[offset: offset + limit], count
+
+
+def encode_cursor(sort_by: Optional[str], desc: bool, row: dict) -> str:
+    value = dot_getter(row, sort_by, False) if sort_by else None
+    return base64.urlsafe_b64encode(json.dumps([sort_by, desc, value, row["id"]]).encode()).decode()
+
+
+def decode_cursor(cursor: str, sort_by: Optional[str], desc: bool) -> Tuple[Any, int]:
+    try:
+        c_sort_by, c_desc, value, id_ = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+    if c_sort_by != sort_by or bool(c_desc) != bool(desc) or not isinstance(id_, int):
+        raise ValueError("Cursor does not match the sort order")
+
+    return value, id_
 
 
 def dot_getter(d: dict, k: str, get_data: bool = True) -> Any:
+    return field_getter(k, get_data)(d)
+
+
+@functools.lru_cache(maxsize=1024)
+def field_getter(k: str, get_data: bool = True) -> Callable[[dict], Any]:
     if k[0] == "@":
-        return data_getter(d, k[1:])
+        data_k = k[1:]
+        return lambda d: data_getter(d, data_k)
+
+    path = k.split(".")
+    get_data = get_data and k not in {"nextReview", "srsLevel", "created", "modified",
+                                        "stat.streak.right", "stat.streak.wrong"}
 
-    v = d
+    def getter(d: dict) -> Any:
+        v = d
 
-    for kn in k.split("."):
-        if isinstance(v, dict):
-            if kn == "*":
-                v = list(v.values())
+        for kn in path:
+            if isinstance(v, dict):
+                if kn == "*":
+                    v = list(v.values())
+                else:
+                    v = v.get(kn, dict())
+            elif isinstance(v, list):
+                try:
+                    v = v[int(kn)]
+                except (IndexError, ValueError):
+                    v = None
+                    break
             else:
-                v = v.get(kn, dict())
-        elif isinstance(v, list):
-            try:
-                v = v[int(kn)]
-            except (IndexError, ValueError):
-                v = None
                 break
-        else:
-            break
 
-    if isinstance(v, dict) and len(v) == 0:
-        v = None
+        if isinstance(v, dict) and len(v) == 0:
+            v = None
 
-    if get_data and k not in {"nextReview", "srsLevel"}:
-        data = data_getter(d, k)
-        if data is not None:
-            if v is not None:
-                if isinstance(data, list):
-                    if isinstance(v, list):
-                        v = [*v, *data]
-                    elif v is not None:
-                        v = [v, *data]
+        if get_data:
+            data = data_getter(d, k)
+            if data is not None:
+                if v is not None:
+                    if isinstance(data, list):
+                        if isinstance(v, list):
+                            v = [*v, *data]
+                        else:
+                            v = [v, *data]
                     else:
-                        v = data
+                        if isinstance(v, list):
+                            v = [*v, data]
+                        else:
+                            v = [v, data]
                 else:
-                    if isinstance(v, list):
-                        v = [*v, data]
-                    elif v is not None:
-                        v = [v, data]
-                    else:
-                        v = data
-            else:
-                v = data
+                    v = data
+
+        return v
+
+    return getter
 
-    return v
+
+class CardRow(dict):
+    """
+    A card, as `Db.getAll` yields it; note fields are indexed by lowercased key on first lookup,
+    so that `data_getter` need not scan `data` for every predicate.
+    """
+    __slots__ = ("_data_index",)
+
+    @property
+    def data_index(self) -> dict:
+        try:
+            return self._data_index
+        except AttributeError:
+            self._data_index = dict()
+            if isinstance(self.get("data"), list):
+                for v0 in self["data"]:
+                    if isinstance(v0, dict) and isinstance(v0.get("key"), str):
+                        self._data_index.setdefault(v0["key"].lower(), v0.get("value"))
+
+            return self._data_index
 
 
 def data_getter(d: dict, k: str) -> Union[str, None]:
@@ -313,59 +554,19 @@ def data_getter(d: dict, k: str) -> Union[str, None]:
         if k == "*":
             # noinspection PyTypeChecker
             return [v0["value"] for v0 in d["data"] if not v0["value"].startswith("@nosearch\n")]
+        elif isinstance(d, CardRow):
+            return d.data_index.get(k)
         else:
             if d["data"]:
                 for v0 in d["data"]:
                     if v0["key"].lower() == k:
                         return v0["value"]
-    except AttributeError:
+    except (AttributeError, TypeError):
         pass
 
     return None
 
 
-def _mongo_compare(v, v_obj: dict) -> bool:
-    for op, v0 in v_obj.items():
-        try:
-            if op == "$regex":
-                if isinstance(v, list):
-                    return any(re.search(str(v0), str(b), flags=re.IGNORECASE) for b in v)
-                else:
-                    return re.search(str(v0), str(v), flags=re.IGNORECASE) is not None
-            elif op == "$substr":
-                if isinstance(v, list):
-                    return any(str(v0) in str(b) for b in v)
-                else:
-                    return str(v0) in str(v)
-            elif op == "$startswith":
-                if isinstance(v, list):
-                    return any(str(b).startswith(str(v0)) for b in v)
-                else:
-                    return str(v).startswith(str(v0))
-            elif op == "$exists":
-                return (v is not None) == v0
-            else:
-                try:
-                    _v = int(v)
-                    _v0 = int(v0)
-                    v, v0 = _v, _v0
-                except ValueError:
-                    pass
-
-                if op == "$gte":
-                    return v >= v0
-                elif op == "$gt":
-                    return v > v0
-                elif op == "$lte":
-                    return v <= v0
-                elif op == "$lt":
-                    return v < v0
-        except TypeError:
-            pass
-
-    return False
-
-
 def _sort_convert(x) -> Union[float, str]:
     if x is None:
         return -math.inf
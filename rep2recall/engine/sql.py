@@ -0,0 +1,514 @@
+import re
+import functools
+import sqlite3
+from typing import Any, List, Optional, Tuple, Callable, Dict, Set
+
+# Columns of the `getAll` join, as seen by `dot_getter`
+COLUMNS = {
+    "id": ("c.id", int),
+    "front": ("c.front", str),
+    "back": ("c.back", str),
+    "mnemonic": ("c.mnemonic", str),
+    "srsLevel": ("c.srsLevel", int),
+    "nextReview": ("c.nextReview", int),
+    "deck": ("d.name", str),
+    "created": ("c.created", int),
+    "modified": ("c.modified", int),
+    "stat.streak.right": ("c.streakRight", int),
+    "stat.streak.wrong": ("c.streakWrong", int),
+    "template": ("t.name", str),
+    "model": ("t.model", str),
+    "tFront": ("t.front", str),
+    "tBack": ("t.back", str),
+    "css": ("t.css", str),
+    "js": ("t.js", str),
+    "key": ("n.key", str),
+    "source": ("s.name", str),
+    "sourceH": ("s.h", str),
+    "sourceCreated": ("s.created", str)
+}
+NO_DATA = {"nextReview", "srsLevel", "created", "modified", "stat.streak.right", "stat.streak.wrong"}
+NOSEARCH = "@nosearch\n"
+
+# Indexed sort keys, whose SQL ordering matches `sort_key`
+SORT_COLUMNS = {
+    "id": "c.id",
+    "deck": "d.name",
+    "nextReview": "c.nextReview",
+    "srsLevel": "c.srsLevel",
+    "stat.streak.right": "c.streakRight",
+    "stat.streak.wrong": "c.streakWrong"
+}
+
+# Columns of the `cardFts` index; `data` holds every note field value
+FTS_COLUMNS = {"front", "back", "mnemonic", "deck", "tag", "template"}
+FTS_MIN_LENGTH = 3
+
+SqlPart = Tuple[str, List[Any]]
+
+
+def register_functions(conn: sqlite3.Connection):
+    conn.create_function("regexp", 2, _regexp)
+
+
+def cond_to_sql(cond: Optional[dict], fts: bool = False) -> Tuple[str, List[Any], Optional[dict]]:
+    """
+    Splits a condition into an SQL WHERE clause over the `getAll` join, and the remainder
+    that has to be filtered in Python with `mongo_filter`.
+
+    With `fts`, substring terms are first narrowed down by the `cardFts` trigram index.
+    """
+    if not cond:
+        return "1", [], None
+
+    where = []
+    params = []
+    residual = []
+
+    for c in _flatten_and(cond):
+        if fts:
+            m = _fts_match(c)
+            if m:
+                where.append("c.id IN (SELECT rowid FROM cardFts WHERE cardFts MATCH ?)")
+                params.append(m)
+
+        try:
+            w, p = _to_sql(c)
+            where.append(w)
+            params.extend(p)
+        except ValueError:
+            residual.append(c)
+
+    if len(residual) == 0:
+        residual = None
+    elif len(residual) == 1:
+        residual = residual[0]
+    else:
+        residual = {"$and": residual}
+
+    return _join("AND", where), params, residual
+
+
+def sort_to_sql(sort_by: Optional[str], desc: bool = False) -> Optional[str]:
+    """
+    ORDER BY clause, or None if the sort cannot be done by SQLite.
+    Ties keep `c.id` order, the same as the stable sort of `sort_page`.
+    """
+    if not sort_by:
+        return "c.id"
+    elif sort_by == "random":
+        return "RANDOM()"
+    elif sort_by in SORT_COLUMNS:
+        return f"{SORT_COLUMNS[sort_by]} {'DESC' if desc else 'ASC'}, c.id"
+
+    return None
+
+
+def seek_to_sql(sort_by: Optional[str], desc: bool, value: Any, id_: int) -> SqlPart:
+    """
+    Rows after a keyset cursor, in the order of `sort_to_sql`
+    """
+    if not sort_by:
+        return "c.id > ?", [id_]
+
+    col = SORT_COLUMNS[sort_by]
+
+    # NULLs come first in ascending order, and last in descending order
+    if value is None:
+        if desc:
+            return f"({col} IS NULL AND c.id > ?)", [id_]
+
+        return f"({col} IS NOT NULL OR c.id > ?)", [id_]
+
+    if desc:
+        return f"({col} < ? OR ({col} = ? AND c.id > ?) OR {col} IS NULL)", [value, value, id_]
+
+    return f"({col}, c.id) > (?, ?)", [value, id_]
+
+
+def _flatten_and(cond: dict) -> List[dict]:
+    if isinstance(cond, dict) and cond and next(iter(cond)) == "$and":
+        output = []
+        for c in cond["$and"]:
+            output.extend(_flatten_and(c))
+        return output
+
+    return [cond]
+
+
+def _join(op: str, where: List[str]) -> str:
+    if len(where) == 0:
+        return "1" if op == "AND" else "0"
+    elif len(where) == 1:
+        return where[0]
+
+    return "(" + f" {op} ".join(where) + ")"
+
+
+def _to_sql(cond: dict) -> SqlPart:
+    if not isinstance(cond, dict):
+        raise ValueError("Not a condition")
+
+    where = []
+    params = []
+
+    def _output(w: str, p: List[Any]) -> SqlPart:
+        return _join("AND", where + [w]), params + p
+
+    for k, v in cond.items():
+        if k[0] == "$":
+            if k in {"$and", "$or"}:
+                sub = [_to_sql(x) for x in v]
+                return _output(_join(k[1:].upper(), [w for w, _ in sub]), [p0 for _, p in sub for p0 in p])
+            elif k == "$not":
+                w, p = _to_sql(v)
+                return _output(f"NOT {w}", p)
+            elif k == "$deck":
+                return _output("c.deckId IN (SELECT deckId FROM deckAncestor WHERE ancestor = ?)", [str(v)])
+        elif isinstance(v, dict) and any(k0[0] == "$" for k0 in v.keys()):
+            return _output(*_compare(_Field(k), v))
+        else:
+            w, p = _Field(k).any_value(_eq_pred(v))
+            where.append(w)
+            params.extend(p)
+
+    return _join("AND", where), params
+
+
+class _Field:
+    """
+    Value expressions of a key, as `dot_getter` sees it. Predicates are templates,
+    where `{0}` is the value expression and comes before all of the predicate's parameters.
+    """
+
+    def __init__(self, k: str):
+        self.col = None
+        self.is_tag = False
+        self.data_key = None
+
+        if k[0] == "@":
+            self.data_key = k[1:].lower()
+        elif k not in COLUMNS and ("." in k or "*" in k or k in {"data", "stat"}):
+            raise ValueError(f"Cannot translate {k}")
+        else:
+            self.col = COLUMNS.get(k)
+            self.is_tag = k == "tag"
+            if k not in NO_DATA:
+                self.data_key = k.lower()
+
+    @property
+    def data(self) -> SqlPart:
+        # `noteField` keeps the first field of a key, as `data_getter` does
+        return "(SELECT nf.value FROM noteField AS nf WHERE nf.noteId = c.noteId AND nf.lowerKey = ?)", [self.data_key]
+
+    def data_match(self, r: SqlPart) -> SqlPart:
+        """
+        Notes whose field matches the predicate `r`, by the `(lowerKey, value)` index
+        """
+        return (f"(c.noteId IS NOT NULL AND c.noteId IN (SELECT nf.noteId FROM noteField AS nf "
+                f"WHERE nf.lowerKey = ? AND nf.value IS NOT NULL AND {r[0].format('nf.value')}))",
+                [self.data_key, *r[1]])
+
+    def has_value(self) -> SqlPart:
+        if self.is_tag:
+            return "1", []
+
+        where = []
+        params = []
+
+        if self.col:
+            where.append(f"{self.col[0]} IS NOT NULL")
+
+        if self.data_key == "*":
+            where.append("n.data IS NOT NULL")
+        elif self.data_key:
+            w, p = self.data
+            where.append(f"{w} IS NOT NULL")
+            params.extend(p)
+
+        return _join("OR", where), params
+
+    def any_value(self, pred: Callable[[type], Optional[SqlPart]]) -> SqlPart:
+        """
+        `pred` returns the predicate for a value type, or None if always false.
+        """
+        where = []
+        params = []
+
+        if self.col:
+            r = pred(self.col[1])
+            if r:
+                where.append(f"({self.col[0]} IS NOT NULL AND {r[0].format(self.col[0])})")
+                params.extend(r[1])
+
+        if self.is_tag:
+            r = pred(str)
+            if r:
+                where.append("EXISTS (SELECT 1 FROM cardTag AS ct INNER JOIN tag AS tg ON tg.id = ct.tagId "
+                             f"WHERE ct.cardId = c.id AND {r[0].format('tg.name')})")
+                params.extend(r[1])
+
+        if self.data_key == "*":
+            r = pred(str)
+            if r:
+                value = "json_extract(f.value, '$.value')"
+                where.append(f"EXISTS (SELECT 1 FROM json_each(n.data) AS f "
+                             f"WHERE substr({value}, 1, {len(NOSEARCH)}) <> ? AND {r[0].format(value)})")
+                params.extend([NOSEARCH, *r[1]])
+        elif self.data_key:
+            r = pred(str)
+            if r:
+                w, p = self.data_match(r)
+                where.append(w)
+                params.extend(p)
+
+        return _join("OR", where), params
+
+    def single_value(self, pred: Callable[[type], Optional[SqlPart]]) -> SqlPart:
+        """
+        Values, where `dot_getter` yields a scalar, rather than a list
+        """
+        if self.is_tag or self.data_key == "*":
+            return "0", []
+
+        where = []
+        params = []
+
+        if self.col:
+            r = pred(self.col[1])
+            if r:
+                w = f"{self.col[0]} IS NOT NULL AND {r[0].format(self.col[0])}"
+                p = list(r[1])
+                if self.data_key:
+                    w1, p1 = self.data
+                    w += f" AND {w1} IS NULL"
+                    p.extend(p1)
+                where.append(f"({w})")
+                params.extend(p)
+
+        if self.data_key:
+            r = pred(str)
+            if r:
+                if self.col:
+                    w, p = self.data
+                    w = f"({self.col[0]} IS NULL AND IFNULL({r[0].format(w)}, 0))"
+                    p = [*p, *r[1]]
+                else:
+                    w, p = self.data_match(r)
+                where.append(w)
+                params.extend(p)
+
+        return _join("OR", where), params
+
+
+def _eq_pred(v):
+    if isinstance(v, bool) or not isinstance(v, (str, int, float)):
+        raise ValueError(f"Cannot translate equality to {v!r}")
+
+    def pred(t: type):
+        if (t is str) == isinstance(v, str):
+            return "{0} = ?", [v]
+
+        return None
+
+    return pred
+
+
+def _compare(field: _Field, v_obj: dict) -> SqlPart:
+    if len(v_obj) != 1:
+        raise ValueError("Cannot translate multiple operators")
+
+    op, v0 = next(iter(v_obj.items()))
+
+    if op == "$exists":
+        if not isinstance(v0, bool):
+            raise ValueError("Cannot translate non-boolean $exists")
+
+        w, p = field.has_value()
+        return (w, p) if v0 else (f"NOT {w}", p)
+    elif op in {"$regex", "$substr", "$startswith"}:
+        v0 = str(v0)
+
+        if op == "$regex":
+            try:
+                _re_compile(v0)
+            except re.error:
+                raise ValueError(f"Invalid regex {v0}")
+
+            w, p = field.any_value(lambda t: ("{0} REGEXP ?", [v0]))
+            null_match = _regexp(v0, "None")
+        elif op == "$substr":
+            w, p = field.any_value(lambda t: ("instr({0}, ?) > 0", [v0]))
+            null_match = v0 in "None"
+        else:
+            w, p = field.any_value(lambda t: ("substr({0}, 1, ?) = ?", [len(v0), v0]))
+            null_match = "None".startswith(v0)
+
+        # `_mongo_compare` matches a missing value as the string "None"
+        if null_match:
+            w1, p1 = field.has_value()
+            return f"({w} OR NOT {w1})", p + p1
+
+        return w, p
+    elif op in _CMP_OPS:
+        if isinstance(v0, bool) or not isinstance(v0, (str, int, float)):
+            raise ValueError(f"Cannot translate comparison to {v0!r}")
+
+        try:
+            v0 = int(v0)
+        except (ValueError, OverflowError):
+            if not isinstance(v0, str):
+                raise ValueError(f"Cannot translate comparison to {v0!r}")
+
+            return field.single_value(lambda t: ("{0} %s ?" % _CMP_OPS[op], [v0]) if t is str else None)
+
+        # Numeric texts are compared as `int` in Python
+        if field.data_key or not field.col or field.col[1] is not int:
+            raise ValueError("Cannot translate numeric comparison of text")
+
+        return field.single_value(lambda t: ("{0} %s ?" % _CMP_OPS[op], [v0]))
+
+    return "0", []
+
+
+def _fts_match(cond: dict) -> Optional[str]:
+    """
+    An FTS5 query, whose matches are a superset of the cards matching `cond`; or None, if there is none.
+    """
+    terms = _fts_terms(cond)
+    if terms:
+        return " OR ".join("{%s} : (%s)" % (" ".join(sorted(cols)), " AND ".join(map(_fts_quote, _fts_runs(lit))))
+                           for lit, cols in terms.items())
+
+    if not isinstance(cond, dict):
+        return None
+
+    for k, v in cond.items():
+        if k == "$and":
+            sub = [m for m in map(_fts_match, v) if m]
+            return " AND ".join(f"({m})" for m in sub) if sub else None
+        elif k == "$or":
+            sub = list(map(_fts_match, v))
+            return " OR ".join(f"({m})" for m in sub) if sub and all(sub) else None
+        elif k[0] == "$":
+            return None
+
+    return None
+
+
+def _fts_terms(cond: dict) -> Optional[Dict[str, Set[str]]]:
+    """
+    Disjunction of `{literal: columns}`, for substring-like leaves and `$or`s of them
+    """
+    if not isinstance(cond, dict) or len(cond) != 1:
+        return None
+
+    k, v = next(iter(cond.items()))
+
+    if k == "$or":
+        output = dict()
+        for x in v:
+            terms = _fts_terms(x)
+            if not terms:
+                return None
+
+            for lit, cols in terms.items():
+                output.setdefault(lit, set()).update(cols)
+
+        return output or None
+    elif k[0] == "$":
+        return None
+
+    if isinstance(v, dict):
+        if len(v) != 1:
+            return None
+
+        op, v0 = next(iter(v.items()))
+        v0 = str(v0)
+
+        if op == "$regex":
+            lit = re.sub(r"\\(.)", r"\1", v0, flags=re.DOTALL)
+            if re.escape(lit) != v0 or _regexp(v0, "None"):
+                return None
+        elif op == "$substr":
+            lit = v0
+            if lit in "None":
+                return None
+        elif op == "$startswith":
+            lit = v0
+            if "None".startswith(lit):
+                return None
+        else:
+            return None
+    elif isinstance(v, str):
+        lit = v
+    else:
+        return None
+
+    if not _fts_runs(lit):
+        return None
+
+    try:
+        field = _Field(k)
+    except ValueError:
+        return None
+
+    # Equality on a note field alone is an index lookup on `noteField`
+    if not isinstance(v, dict) and field.data_key and not field.col and not field.is_tag:
+        return None
+
+    cols = set()
+    if field.is_tag:
+        cols.add("tag")
+
+    if field.col:
+        if k not in FTS_COLUMNS:
+            return None
+        cols.add(k)
+
+    if field.data_key:
+        cols.add("data")
+
+    if not cols:
+        return None
+
+    return {lit: cols}
+
+
+def _fts_runs(lit: str) -> List[str]:
+    """
+    Runs of `lit`, of at least `FTS_MIN_LENGTH`, whose case folding in FTS5 agrees with `re.IGNORECASE`;
+    i.e. split on cased non-ASCII characters, and on i, k and s, which also match İ, ı, K (Kelvin) and ſ.
+    """
+    output = [""]
+    for ch in lit:
+        if ch in "iIkKsS" or not ch.isascii() and not ch.lower() == ch.upper() == ch.casefold():
+            output.append("")
+        else:
+            output[-1] += ch
+
+    return [r for r in output if len(r) >= FTS_MIN_LENGTH]
+
+
+def _fts_quote(s: str) -> str:
+    return '"' + s.replace('"', '""') + '"'
+
+
+_CMP_OPS = {
+    "$gte": ">=",
+    "$gt": ">",
+    "$lte": "<=",
+    "$lt": "<"
+}
+
+
+@functools.lru_cache(maxsize=256)
+def _re_compile(pattern: str):
+    return re.compile(pattern, flags=re.IGNORECASE)
+
+
+def _regexp(pattern: str, s: Any) -> Optional[bool]:
+    if s is None:
+        return None
+
+    return _re_compile(pattern).search(str(s)) is not None
@@ -51,13 +51,15 @@ class ICondOptions:
     limit: int = None
     sortBy: str = None
     desc: bool = False
-    fields: List[str] = dc.field(default_factory=list)
+    fields: List[str] = None
+    cursor: str = None
 
 
 @dc.dataclass
 class IPagedOutput:
     data: List[dict]
     count: int
+    cursor: str = None
 
 
 @dc.dataclass
@@ -1,13 +1,144 @@
 import re
-from typing import List, Union
+import functools
+from typing import List, Union, Iterable, Iterator, TypeVar, Any, Hashable, Optional, Tuple
+from collections import OrderedDict
+from threading import Lock
+from datetime import datetime
 
 from .typing import IDataSocket
 
+T = TypeVar("T")
+
 
 def ankiMustache(s: str, d: List[Union[dict, IDataSocket]] = None, front: str = "") -> str:
     if d is None:
         d = []
 
+    segments = _compileTemplate(s)
+    if segments is None:
+        return _ankiMustacheRegex(s, d, front)
+
+    keys = set()
+    values = dict()
+    order = dict()
+    for i, item in enumerate(d):
+        k = item["key"]
+        if _UNSAFE_KEY.search(k):
+            return _ankiMustacheRegex(s, d, front)
+
+        keys.add(k)
+        if isinstance(item["value"], str) and k not in values:
+            value = _AT_LINE.sub("", item["value"])
+            if _UNSAFE_VALUE.search(value):
+                return _ankiMustacheRegex(s, d, front)
+
+            values[k] = value
+            order[k] = i
+
+    front_side = front.replace("@html\n", "")
+
+    output = []
+    chain = []
+    for kind, a, b, c in segments:
+        if kind == _LITERAL:
+            output.append(a)
+            if b:
+                chain = []
+        elif kind == _FRONT_SIDE:
+            if _UNSAFE_VALUE.search(front_side):
+                return _ankiMustacheRegex(s, d, front)
+
+            output.append(front_side)
+            if _WHITESPACE.search(front_side):
+                chain = []
+        else:
+            if c in values and not _isSeparated(chain, values, order, order[c]):
+                return _ankiMustacheRegex(s, d, front)
+
+            output.append(values.get(a, b))
+            chain.append((a, b))
+
+    s = "".join(output)
+    if "{{#" in s:
+        s = _SECTION.sub(lambda m: m[2] if m[1] in keys else "", s)
+    if "{{" in s:
+        s = _LEFTOVER.sub("", s)
+
+    return "@rendered\n" + s
+
+
+_LITERAL, _FIELD, _FRONT_SIDE = range(3)
+_TAG = re.compile(r"{{(.*?)}}", flags=re.DOTALL)
+_WHITESPACE = re.compile(r"\s")
+_AT_LINE = re.compile("^@[^\n]+\n", flags=re.MULTILINE)
+_SECTION = re.compile(r"{{#(\S+)}}(.*){{\1}}", flags=re.DOTALL)
+_LEFTOVER = re.compile(r"{{[^}]+}}")
+_UNSAFE_KEY = re.compile(r"[:{}]")
+_UNSAFE_VALUE = re.compile(r"[{}\\]")
+
+
+@functools.lru_cache(maxsize=512)
+def _compileTemplate(s: str) -> Optional[List[Tuple[int, Any, Any, Any]]]:
+    """
+    Parses a template once into literals, fields and FrontSide, so that it can be rendered in one pass.
+
+    Returns None for nested or unbalanced braces, where the result may differ from `_ankiMustacheRegex`.
+    """
+    segments = []
+    i = 0
+
+    for m in _TAG.finditer(s):
+        literal = s[i:m.start()]
+        content = m[1]
+        if "}}" in literal or "{" in content:
+            return None
+
+        if literal:
+            segments.append((_LITERAL, literal, bool(_WHITESPACE.search(literal)), None))
+
+        if content == "FrontSide":
+            segments.append((_FRONT_SIDE, None, None, None))
+        else:
+            k = content
+            span_key = None
+            if ":" in content:
+                prefix, span_key = content.rsplit(":", 1)
+                if _WHITESPACE.search(prefix):
+                    span_key = None
+                k = span_key if prefix else None
+
+            segments.append((_FIELD, k, m[0], span_key))
+
+        i = m.end()
+
+    literal = s[i:]
+    if "}}" in literal:
+        return None
+
+    if literal:
+        segments.append((_LITERAL, literal, bool(_WHITESPACE.search(literal)), None))
+
+    return segments
+
+
+def _isSeparated(chain: List[Tuple[Optional[str], str]], values: dict, order: dict, i: int) -> bool:
+    """
+    `{{(\\S+:)?key}}` may match from the opening braces of an earlier tag,
+    unless whitespace is in between, by the time the i-th key is substituted.
+    """
+    for k, raw in reversed(chain):
+        if k in values and order[k] < i:
+            if _WHITESPACE.search(values[k]):
+                return True
+        elif _WHITESPACE.search(raw):
+            return True
+        else:
+            return False
+
+    return True
+
+
+def _ankiMustacheRegex(s: str, d: List[Union[dict, IDataSocket]], front: str = "") -> str:
     s = s.replace("{{FrontSide}}", front.replace("@html\n", ""))
 
     keys = set()
@@ -21,3 +152,92 @@ def ankiMustache(s: str, d: List[Union[dict, IDataSocket]] = None, front: str =
     s = re.sub(r"{{[^}]+}}", "", s)
 
     return "@rendered\n" + s
+
+
+def toEpoch(v: Union[datetime, str, int, float, None]) -> Optional[int]:
+    """
+    Unix time in seconds, from a datetime or an ISO string (naive ones are local time), as dates are stored.
+    """
+    if v is None or v == "":
+        return None
+    if isinstance(v, datetime):
+        return int(v.timestamp())
+    if isinstance(v, (int, float)):
+        return int(v)
+
+    try:
+        return int(v)
+    except ValueError:
+        return int(datetime.fromisoformat(v).timestamp())
+
+
+def fromEpoch(v: Optional[int]) -> Optional[str]:
+    """
+    The string form of stored dates, as `str(datetime)` in local time.
+    """
+    if v is None:
+        return None
+
+    return str(datetime.fromtimestamp(v))
+
+
+def chunks(it: Iterable[T], size: int) -> Iterator[List[T]]:
+    chunk = []
+    for x in it:
+        chunk.append(x)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+class LruCache:
+    """
+    Bounded LRU cache, whose entries are only valid for the `state` they were stored with.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: Hashable, state: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] == state:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            self.misses += 1
+            return None
+
+    def set(self, key: Hashable, value: Any, state: Any = None):
+        if self.maxsize <= 0:
+            return
+
+        with self._lock:
+            self._data[key] = (state, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def info(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "maxsize": self.maxsize,
+            "currsize": len(self._data)
+        }
@@ -28,7 +28,14 @@ class Config:
     UPLOAD_FOLDER.mkdir(exist_ok=True)
     atexit.register(shutil.rmtree, str(UPLOAD_FOLDER))
 
-    DB = Db(COLLECTION)
+    # Review answers are written behind, at most this many ms later (lost on a crash); 0 to write each at once.
+    ANSWER_FLUSH_MS = int(os.getenv("ANSWER_FLUSH_MS", "0"))
+
+    # Processes rendering card templates of Anki imports; 0 for one per CPU, 1 to render in the server process.
+    IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", "0")) or os.cpu_count() or 1
+
+    DB = Db(COLLECTION, answerFlushInterval=ANSWER_FLUSH_MS / 1000)
+    DB.getDueQueue()
     atexit.register(DB.close)
 
     MEDIA_FOLDER = DIR.joinpath("media")
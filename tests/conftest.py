@@ -0,0 +1,10 @@
+import pytest
+
+from rep2recall.engine.db import Db
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Db(str(tmp_path.joinpath("user.db")))
+    yield db
+    db.close()
@@ -0,0 +1,89 @@
+import time
+
+import pytest
+
+from rep2recall.engine.db import Db
+
+
+def _stored(db: Db, cId: int) -> tuple:
+    """
+    Answer columns as committed, without flushing queued answers
+    """
+    with db.writeLock:
+        return tuple(db.conn.execute("""
+        SELECT srsLevel, streakRight, streakWrong FROM card WHERE id = ?
+        """, (cId,)).fetchone())
+
+
+@pytest.fixture
+def queued(tmp_path):
+    # Flushed by size, or on reads and writes, rather than by the timer
+    db = Db(str(tmp_path.joinpath("user.db")), answerFlushInterval=3600, answerFlushSize=3)
+    yield db
+    db.close()
+
+
+def test_answers_are_queued(queued):
+    ids = queued.insertMany([{"front": f"card{i}", "deck": "Default"} for i in range(3)])
+
+    queued.markRight(ids[0])
+    queued.markRight(ids[0])
+    queued.markWrong(ids[1])
+    assert _stored(queued, ids[0]) == (None, 0, 0)
+    assert queued.conn.execute("SELECT COUNT(*) FROM revlog").fetchone()[0] == 0
+
+    # A second answer starts from the queued one
+    assert [(c["srsLevel"], c["stat"]["streak"]) for c in queued.getAll()] == [
+        (2, {"right": 2, "wrong": 0}),
+        (0, {"right": 0, "wrong": 1}),
+        (None, {"right": 0, "wrong": 0})
+    ]
+    assert _stored(queued, ids[0]) == (2, 2, 0)
+    assert queued.conn.execute("SELECT COUNT(*) FROM revlog").fetchone()[0] == 3
+
+
+def test_flush_by_size(queued):
+    ids = queued.insertMany([{"front": f"card{i}", "deck": "Default"} for i in range(3)])
+
+    queued.markRight(ids[0])
+    queued.markRight(ids[1])
+    assert len(queued.pendingAnswers) == 2
+
+    queued.markRight(ids[2])
+    assert not queued.pendingAnswers
+    assert [_stored(queued, cId) for cId in ids] == [(1, 1, 0)] * 3
+
+
+def test_writes_go_after_queued_answers(queued):
+    cId = queued.insertMany([{"front": "card", "deck": "Default"}])[0]
+
+    queued.markRight(cId)
+    queued.update(cId, {"srsLevel": 5})
+    assert _stored(queued, cId) == (5, 1, 0)
+
+
+def test_flush_on_close(tmp_path):
+    filename = str(tmp_path.joinpath("user.db"))
+
+    db = Db(filename, answerFlushInterval=3600)
+    cId = db.insertMany([{"front": "card", "deck": "Default"}])[0]
+    db.markWrong(cId)
+    db.close()
+
+    db = Db(filename)
+    assert _stored(db, cId) == (0, 0, 1)
+    db.close()
+
+
+def test_flush_by_timer(tmp_path):
+    db = Db(str(tmp_path.joinpath("user.db")), answerFlushInterval=0.05)
+    cId = db.insertMany([{"front": "card", "deck": "Default"}])[0]
+    db.markRight(cId)
+
+    for _ in range(100):
+        if _stored(db, cId) == (1, 1, 0):
+            break
+        time.sleep(0.05)
+
+    assert _stored(db, cId) == (1, 1, 0)
+    db.close()
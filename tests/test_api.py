@@ -0,0 +1,57 @@
+import os
+import tempfile
+
+import pytest
+from flask import Flask
+
+# Config opens the collection on import
+os.environ["COLLECTION"] = os.path.join(tempfile.mkdtemp(), "user.db")
+
+from rep2recall.shared import Config  # noqa: E402
+from rep2recall.api.editor import api_editor  # noqa: E402
+from rep2recall.api.quiz import api_quiz  # noqa: E402
+
+
+@pytest.fixture
+def client(db, monkeypatch):
+    monkeypatch.setattr(Config, "DB", db)
+
+    app = Flask(__name__)
+    app.register_blueprint(api_editor)
+    app.register_blueprint(api_quiz)
+
+    return app.test_client()
+
+
+def test_rename_deck(client, db):
+    db.insertMany([{"front": "a", "deck": "A/B"}])
+
+    r = client.put("/api/editor/renameDeck", json={"old": "A", "new": "A/B/C"})
+    assert r.status_code == 400
+    assert "own subdeck" in r.get_json()["error"]
+
+    r = client.put("/api/editor/renameDeck", json={"old": "A", "new": "X"})
+    assert r.status_code == 200
+    assert [c["deck"] for c in db.getAll()] == ["X/B"]
+
+
+@pytest.mark.parametrize("duration", ["abc", -1, "NaN", [1], {"ms": 1}])
+def test_answer_invalid_duration(client, db, duration):
+    cId = db.insertMany([{"front": "a", "deck": "A"}])[0]
+
+    for path in ["/api/quiz/right", "/api/quiz/wrong"]:
+        r = client.put(path, json={"id": cId, "duration": duration})
+        assert r.status_code == 400
+        assert r.get_json()["error"]
+
+    assert db.getAll()[0]["srsLevel"] is None
+    assert db.conn.execute("SELECT COUNT(*) FROM revlog").fetchone()[0] == 0
+
+
+@pytest.mark.parametrize("duration", [None, 1500, 1500.7, "1500"])
+def test_answer_duration(client, db, duration):
+    cId = db.insertMany([{"front": "a", "deck": "A"}])[0]
+
+    r = client.put("/api/quiz/right", json={"id": cId, "duration": duration})
+    assert r.status_code == 200
+    assert db.conn.execute("SELECT duration FROM revlog").fetchone()[0] == (None if duration is None else 1500)
@@ -0,0 +1,64 @@
+import pytest
+
+
+def _decks(db) -> dict:
+    """
+    Deck name, to the fronts of its cards
+    """
+    output = dict()
+    for c in db.getAll():
+        output.setdefault(c["deck"], set()).add(c["front"])
+
+    return output
+
+
+def _assert_consistent(db):
+    assert db.conn.execute("""
+    SELECT COUNT(*) FROM card WHERE deckId NOT IN (SELECT id FROM deck)
+    """).fetchone()[0] == 0
+    assert len(db.getAll()) == db.conn.execute("SELECT COUNT(*) FROM card").fetchone()[0]
+
+    for name, in db.conn.execute("SELECT name FROM deck"):
+        ancestors = set(r[0] for r in db.conn.execute("""
+        SELECT ancestor FROM deckAncestor WHERE deckId = (SELECT id FROM deck WHERE name = ?)
+        """, (name,)))
+        parts = name.split("/")
+        assert ancestors == set("/".join(parts[:i + 1]) for i in range(len(parts)))
+
+
+def test_rename_subtree(db):
+    db.insertMany([{"front": d, "deck": d} for d in ["A", "A/B", "A/B/C", "AB", "X"]])
+    db.renameDeck("A", "Y/Z")
+
+    assert _decks(db) == {"Y/Z": {"A"}, "Y/Z/B": {"A/B"}, "Y/Z/B/C": {"A/B/C"}, "AB": {"AB"}, "X": {"X"}}
+    _assert_consistent(db)
+
+
+def test_rename_merges_into_existing(db):
+    db.insertMany([{"front": d, "deck": d} for d in ["A", "A/B", "X", "X/B"]])
+    db.renameDeck("A", "X")
+
+    assert _decks(db) == {"X": {"A", "X"}, "X/B": {"A/B", "X/B"}}
+    _assert_consistent(db)
+
+
+@pytest.mark.parametrize("decks, old, new, expected", [
+    (["P", "P/Q", "P/Q/Q"], "P/Q", "P", {"P": {"P", "P/Q"}, "P/Q": {"P/Q/Q"}}),
+    (["A", "A/B", "A/B/C"], "A/B/C", "A/B", {"A": {"A"}, "A/B": {"A/B", "A/B/C"}}),
+    (["A", "A/B", "A/B/C", "A/B/C/C"], "A/B/C", "A/B", {"A": {"A"}, "A/B": {"A/B", "A/B/C"}, "A/B/C": {"A/B/C/C"}}),
+    (["P", "P/Q", "P/Q/Q", "P/Q/Q/Q"], "P/Q", "P",
+     {"P": {"P", "P/Q"}, "P/Q": {"P/Q/Q"}, "P/Q/Q": {"P/Q/Q/Q"}}),
+])
+def test_rename_into_ancestor(db, decks, old, new, expected):
+    db.insertMany([{"front": d, "deck": d} for d in decks])
+    db.renameDeck(old, new)
+
+    assert _decks(db) == expected
+    _assert_consistent(db)
+
+
+def test_rename_into_own_subdeck(db):
+    db.insertMany([{"front": "A", "deck": "A"}])
+
+    with pytest.raises(ValueError):
+        db.renameDeck("A", "A/B")
@@ -0,0 +1,53 @@
+import sqlite3
+
+import pytest
+
+from rep2recall.engine.db import Db
+from rep2recall.engine.migrate import MIGRATIONS, deferred_fts
+from rep2recall.engine.search import SearchParser
+
+
+def _search(db: Db, q: str):
+    return sorted(c["front"] for c in db.getAll(SearchParser().parse(q).cond))
+
+
+def test_deferred_fts_is_reset_on_error(db):
+    with pytest.raises(sqlite3.IntegrityError):
+        with deferred_fts(db.conn):
+            db.conn.execute("INSERT INTO tag (name) VALUES (NULL)")
+
+    db.conn.commit()
+    assert db.conn.execute("SELECT COUNT(*) FROM ftsDeferred").fetchone()[0] == 0
+
+    db.insertMany([{"front": "apple", "deck": "Default"}])
+    db.update(db.getAll()[0]["id"], {"front": "zebra"})
+    assert _search(db, "zebra") == ["zebra"]
+
+
+def test_writer_rolls_back(db):
+    cId = db.insertMany([{"front": "apple", "deck": "Default"}])[0]
+
+    with pytest.raises(sqlite3.IntegrityError):
+        db.update(cId, {"front": "zebra", "tag": [None]})
+
+    db.update(cId, {"back": "fruit"})
+    assert [(c["front"], c["back"]) for c in db.getAll()] == [("apple", "fruit")]
+    assert _search(db, "zebra") == []
+
+
+def test_stale_fts_is_rebuilt(tmp_path):
+    filename = str(tmp_path.joinpath("user.db"))
+
+    db = Db(filename)
+    cId = db.insertMany([{"front": "apple", "deck": "Default"}])[0]
+    # As a failed tag edit, committed by the next write, left it before
+    db.conn.execute("INSERT INTO ftsDeferred (id) VALUES (1)")
+    db.conn.execute("UPDATE card SET front = 'zebra' WHERE id = ?", (cId,))
+    db.conn.execute(f"PRAGMA user_version = {len(MIGRATIONS) - 1}")
+    db.conn.commit()
+    db.close()
+
+    db = Db(filename)
+    assert _search(db, "zebra") == ["zebra"]
+    assert _search(db, "apple") == []
+    db.close()
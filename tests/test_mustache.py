@@ -0,0 +1,33 @@
+import random
+
+import pytest
+
+from rep2recall.engine.util import ankiMustache, _ankiMustacheRegex
+
+ATOMS = ["<p>", "{{h:a}}", "{{x:b}}", "{{#a}}", "{{a}}", "{{", "}}", "{", "}", ":", " ", "\n", "a", "b", "K", "Front",
+         "{{Front}}", "{{Back}}", "{{hint:Back}}", "{{#Front}}", "{{/Front}}", "{{FrontSide}}", "{{type:cloze:K}}",
+         "<br>", "x", "#", "\\", "@", "{{K}}", "{{#K}}", "{{:K}}", "{{x y:K}}"]
+VALUES = ["foo", "bar baz", "@html\nhi", "with {{Back}}", "\\n", "a\n@x\nb", "{", "", "x:y", "Front", None, 1]
+KEYS = ["Front", "Back", "K", "a", "b", "x y", "a:b"]
+FRONTS = ["", "@rendered\nfront", "@html\nfr{ont", "a b"]
+
+
+def _render(f, *args):
+    try:
+        return f(*args)
+    except Exception as e:
+        return type(e)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_fuzz(seed):
+    """
+    The compiled renderer gives the output of the regex one, byte for byte, or raises the same error
+    """
+    rnd = random.Random(seed)
+    for _ in range(2000):
+        t = "".join(rnd.choice(ATOMS) for _ in range(rnd.randint(0, 12)))
+        d = [{"key": rnd.choice(KEYS), "value": rnd.choice(VALUES)} for _ in range(rnd.randint(0, 5))]
+        front = rnd.choice(FRONTS)
+
+        assert _render(ankiMustache, t, d, front) == _render(_ankiMustacheRegex, t, d, front), (t, d, front)
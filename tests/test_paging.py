@@ -0,0 +1,44 @@
+import pytest
+
+from rep2recall.engine.typing import IParserResult, ICondOptions
+
+
+@pytest.fixture
+def cards(db):
+    db.insertMany([{
+        "front": f"card{i % 5}",
+        "deck": ["A", "B", "C"][i % 3],
+        "srsLevel": i % 4 or None
+    } for i in range(12)])
+
+    return db
+
+
+# SQL paging, with an indexed sort key; and in Python, with an unindexed one, or a residual condition
+@pytest.mark.parametrize("cond,sortBy", [
+    ({}, "deck"),
+    ({}, "srsLevel"),
+    ({}, "front"),
+    ({"data": {"$exists": False}}, "deck")
+])
+@pytest.mark.parametrize("desc", [False, True])
+@pytest.mark.parametrize("limit", [4, 5, 12, 20])
+def test_cursor(cards, cond, sortBy, desc, limit):
+    expected = [c["id"] for c in cards.parseCond(IParserResult(cond=cond, sortBy=sortBy, desc=desc)).data]
+    assert len(expected) == 12
+
+    pages = []
+    cursor = None
+    while True:
+        result = cards.parseCond(IParserResult(cond=cond, sortBy=sortBy, desc=desc),
+                                 ICondOptions(limit=limit, cursor=cursor))
+        assert result.data
+        assert result.count == 12
+        pages.append([c["id"] for c in result.data])
+
+        cursor = result.cursor
+        if cursor is None:
+            break
+
+    assert [len(p) for p in pages[:-1]] == [limit] * (len(pages) - 1)
+    assert sum(pages, []) == expected
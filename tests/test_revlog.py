@@ -0,0 +1,53 @@
+from datetime import date, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def reviewed(db):
+    a, b, c = db.insertMany([{"front": "a", "deck": "A"}, {"front": "b", "deck": "A/B"}, {"front": "c", "deck": "C"}])
+    db.markRight(a, 1000)
+    db.markWrong(a)
+    db.markRight(b, 3000)
+    db.markRight(c)
+
+    return db, (a, b, c)
+
+
+def test_revlog(reviewed):
+    db, (a, b, c) = reviewed
+
+    assert [tuple(r) for r in db.conn.execute("""
+    SELECT cardId, answer, prevSrsLevel, srsLevel, duration FROM revlog ORDER BY id
+    """)] == [(a, 1, None, 1, 1000), (a, -1, 1, 0, None), (b, 1, None, 1, 3000), (c, 1, None, 1, None)]
+
+
+def test_review_stats(reviewed):
+    db, _ = reviewed
+    today = date.today().isoformat()
+
+    assert db.reviewStats() == [{
+        "date": today, "nReview": 4, "nRight": 3, "nNew": 3, "duration": 4000, "nDuration": 2,
+        "retention": 0.75, "averageDuration": 2000
+    }]
+    assert [(r["nReview"], r["nRight"], r["nNew"]) for r in db.reviewStats("A")] == [(3, 2, 2)]
+    assert [(r["nReview"], r["averageDuration"]) for r in db.reviewStats("A/B")] == [(1, 3000)]
+    assert [(r["nReview"], r["averageDuration"]) for r in db.reviewStats("C")] == [(1, None)]
+
+    assert db.reviewStats(since=today, until=today)[0]["nReview"] == 4
+    assert db.reviewStats(since=(date.today() + timedelta(days=1)).isoformat()) == []
+    assert db.reviewStats(until=(date.today() - timedelta(days=1)).isoformat()) == []
+
+
+def test_rollups_follow_deck_renames(reviewed):
+    db, _ = reviewed
+
+    db.renameDeck("A/B", "C")
+    assert [r["nReview"] for r in db.reviewStats("A")] == [2]
+    assert [r["nReview"] for r in db.reviewStats("C")] == [2]
+    assert db.reviewStats("A/B") == []
+
+    db.renameDeck("C", "A")
+    assert [r["nReview"] for r in db.reviewStats("A")] == [4]
+    assert db.reviewStats()[0]["nReview"] == 4
+    assert db.conn.execute("SELECT COUNT(*) FROM revlogDaily").fetchone()[0] == 1
@@ -0,0 +1,101 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+from rep2recall.engine.db import Db
+from rep2recall.engine.util import toEpoch
+
+
+def _expected(db: Db, deck: str = None, until: datetime = None, includeNew: bool = False):
+    """
+    `getDue` by a scan of the collection
+    """
+    rows = [(cId, nextReview) for cId, nextReview, name in db.conn.execute("""
+    SELECT c.id, nextReview, d.name FROM card AS c INNER JOIN deck AS d ON d.id = deckId
+    """) if deck is None or name == deck or name.startswith(deck + "/")]
+
+    output = []
+    if until is not None:
+        output = [cId for nextReview, cId in sorted((r[1], r[0]) for r in rows if r[1] is not None)
+                  if nextReview <= toEpoch(until)]
+    if includeNew:
+        output += sorted(cId for cId, nextReview in rows if nextReview is None)
+
+    return output
+
+
+@pytest.fixture
+def cards(db):
+    now = datetime.now()
+    db.insertMany([{
+        "front": f"card{i}",
+        "deck": ["A", "A/B", "A/B/C", "D"][i % 4],
+        "nextReview": str(now + timedelta(hours=i * 7 % 25 - 12)) if i % 3 else None
+    } for i in range(40)])
+    db.getDueQueue()
+
+    return db
+
+
+def _assert_due(db: Db):
+    until = datetime.now()
+    for deck in [None, "A", "A/B", "D", "X"]:
+        assert db.getDue(deck, until, True) == _expected(db, deck, until, True), deck
+        assert db.getDue(deck, until, True, 5) == _expected(db, deck, until, True)[:5], deck
+        assert db.getDue(deck, None, True, 3) == _expected(db, deck, None, True)[:3], deck
+
+
+def test_due(cards):
+    _assert_due(cards)
+
+
+def test_due_after_writes(cards):
+    db = cards
+    ids = [c["id"] for c in db.getAll()]
+
+    db.insertMany([{"front": "new", "deck": "A/B"}, {"front": "due", "deck": "D", "nextReview": "2000-01-01"}])
+    _assert_due(db)
+
+    db.deleteMany(ids[:5])
+    db.delete(ids[5])
+    _assert_due(db)
+
+    db.update(ids[6], {"deck": "D"})
+    db.update(ids[7], {"nextReview": "2001-01-01"})
+    db.updateMany(ids[8:12], {"deck": "A/B/C"})
+    _assert_due(db)
+
+    db.renameDeck("A/B", "D")
+    _assert_due(db)
+
+    db.markRight(ids[12])
+    db.markWrong(ids[13])
+    _assert_due(db)
+
+
+def test_due_after_failed_answer(cards):
+    db = cards
+    cId = cards.getDue(None, datetime.now())[0]
+    db.conn.execute("""
+    CREATE TEMP TRIGGER t_revlog_fail BEFORE INSERT ON revlog
+    BEGIN
+        SELECT RAISE(ABORT, 'fail');
+    END
+    """)
+
+    with pytest.raises(sqlite3.IntegrityError):
+        db.markRight(cId)
+
+    assert db.getDue(None, datetime.now())[0] == cId
+    _assert_due(db)
+
+
+def test_due_after_failed_update(cards):
+    db = cards
+    cId = db.getAll()[0]["id"]
+
+    with pytest.raises(sqlite3.IntegrityError):
+        db.update(cId, {"nextReview": "2000-01-01", "tag": [None]})
+
+    _assert_due(db)
@@ -0,0 +1,125 @@
+import random
+from datetime import datetime, timedelta
+from typing import List, Tuple
+
+import pytest
+
+from rep2recall.engine.db import Db
+from rep2recall.engine.search import SearchParser, mongo_filter
+
+WORDS = ["apple", "Banana", "cherry", "None", "nonsense", "5", "12", "日本", "Ελλάδα", "marked", "foo bar", "İstanbul", "ıspanak", "5\u212a"]
+DECKS = ["HSK", "HSK/HSK1", "HSK/HSK2", "JLPT/N5", "JLPT", "Misc", "HSKX"]
+TAGS = ["marked", "leech", "foo", "Bar"]
+DATA_KEYS = ["Front", "pinyin", "Entry", "Meaning", "ΣΙΓΜΑ"]
+
+QUERIES = [
+    "apple", "none", "nonsense", "front:apple", "front=apple1", "back:none", "-back:none", "deck:HSK", "deck=HSK",
+    "srsLevel>3", "srsLevel<=2", "srsLevel=0", "srsLevel:3", "srsLevel=3", "srsLevel>abc",
+    "is:leech", "is:due", "is:new", "is:marked", "tag:ar", "tag=Bar",
+    "nextReview<+1d", "due:+2h", "created>-1d", "modified:NULL", "back:NULL", "-back:NULL",
+    "mnemonic~^b", "front~\\d", "日本", "ελλάδα", "(apple OR cherry) -tag:foo", "-(deck:HSK OR srsLevel>2)",
+    "front>abc", "front>5", "id>5", "key:k1", "12", "5", "is:random",
+    "pinyin:ban", "@pinyin:ban", "@pinyin=apple", "-@pinyin=apple", "Front:apple", "entry:5",
+    "σιγμα:a", "ΣΙΓΜΑ:a", "ΣΙΓΜΑ=日本", "@meaning:NULL", "-@meaning:NULL", "@hidden:apple", "@*:app",
+    "meaning~^b", "@pinyin>m", "@Meaning<c", "@front:None",
+    "istanbul", "İSTANBUL", "front:istanbul", "ıspanak", "5k", "pinyin:istanbul"
+]
+
+CONDS = [
+    {"deck": {"$startswith": "HSK/"}},
+    {"$or": [{"deck": "HSK"}, {"deck": {"$startswith": "HSK/"}}]},
+    {"nextReview": {"$exists": False}},
+    {"tag": {"$exists": True}},
+    {"front": {"$substr": "pp"}},
+    {"back": {"$substr": "on"}},
+    {"srsLevel": {"$gte": 2.7}},
+    {"id": {"$gt": 3}},
+    {"stat.streak.right": 0},
+    {"stat.streak.right": {"$gte": 2}},
+    {"stat.streak.wrong": {"$lt": 1}},
+    {"$or": [{"stat.streak.wrong": {"$gt": 2}}, {"srsLevel": {"$exists": False}}]}
+]
+
+
+@pytest.fixture(scope="module")
+def corpus(tmp_path_factory):
+    rnd = random.Random(0)
+    db = Db(str(tmp_path_factory.mktemp("search").joinpath("user.db")))
+
+    entries = []
+    for i in range(400):
+        e = {"front": rnd.choice(WORDS) + str(rnd.randint(0, 3)), "deck": rnd.choice(DECKS)}
+        if rnd.random() < 0.5:
+            e["back"] = rnd.choice(WORDS)
+        if rnd.random() < 0.3:
+            e["mnemonic"] = rnd.choice(WORDS)
+        if rnd.random() < 0.6:
+            e["srsLevel"] = rnd.randint(0, 7)
+        if rnd.random() < 0.6:
+            e["nextReview"] = str(datetime.now() + timedelta(hours=rnd.randint(-100, 100)))
+        if rnd.random() < 0.5:
+            e["stat"] = {"streak": {"right": rnd.randint(0, 4), "wrong": rnd.randint(0, 4)}}
+        e["tag"] = rnd.sample(TAGS, rnd.randint(0, 3))
+        if rnd.random() < 0.5:
+            e["key"] = f"k{i}"
+            e["data"] = [{"key": rnd.choice(DATA_KEYS), "value": rnd.choice(WORDS)} for _ in range(rnd.randint(1, 3))]
+            if rnd.random() < 0.2:
+                e["data"].append({"key": "hidden", "value": "@nosearch\napple"})
+        entries.append(e)
+
+    db.insertMany(entries)
+    yield db, db.getAll()
+    db.close()
+
+
+def _random_cond(rnd: random.Random, depth: int = 0) -> dict:
+    if depth < 2 and rnd.random() < 0.3:
+        return {rnd.choice(["$and", "$or"]): [_random_cond(rnd, depth + 1) for _ in range(rnd.randint(1, 3))]}
+    if depth < 2 and rnd.random() < 0.1:
+        return {"$not": _random_cond(rnd, depth + 1)}
+
+    k = rnd.choice(["front", "back", "mnemonic", "deck", "tag", "key", "srsLevel", "stat.streak.right",
+                    "stat.streak.wrong", "@pinyin", "@meaning", "@*"] + DATA_KEYS)
+    v = rnd.choice([rnd.choice(WORDS), rnd.choice(WORDS)[:3], rnd.choice(TAGS), rnd.choice(DECKS), rnd.randint(0, 5)])
+    op = rnd.choice([None, "$substr", "$startswith", "$regex", "$gt", "$lte", "$exists"])
+
+    if op is None:
+        return {k: v}
+    if op == "$exists":
+        return {k: {op: rnd.random() < 0.5}}
+    if op == "$regex":
+        v = "^" + str(v)
+    return {k: {op: v}}
+
+
+def _assert_parity(corpus: Tuple[Db, List[dict]], cond: dict):
+    """
+    The SQL, with its residual, selects the cards `mongo_filter` does over every card
+    """
+    db, cards = corpus
+    expected = sorted(c["id"] for c in cards if mongo_filter(cond)(c))
+    assert sorted(c["id"] for c in db.getAll(cond)) == expected, cond
+
+
+@pytest.mark.parametrize("q", QUERIES)
+def test_query(corpus, q):
+    _assert_parity(corpus, SearchParser().parse(q).cond)
+
+
+@pytest.mark.parametrize("cond", CONDS, ids=str)
+def test_cond(corpus, cond):
+    _assert_parity(corpus, cond)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_cond(corpus, seed):
+    rnd = random.Random(seed)
+    for _ in range(25):
+        _assert_parity(corpus, _random_cond(rnd))
+
+
+def test_fts_case_folding(db):
+    db.insertMany([{"front": w, "deck": "Default"} for w in ["İstanbul", "istanbul", "ISTANBUL", "ſtraße", "\u212aelvin"]])
+
+    for q, n in [("istanbul", 3), ("İstanbul", 3), ("stra", 1), ("kelvin", 1)]:
+        assert len(db.getAll(SearchParser().parse(q).cond)) == n, q
@@ -0,0 +1,38 @@
+import sqlite3
+
+import pytest
+
+from rep2recall.engine.search import SearchParser
+
+
+def _search(db, q: str):
+    return sorted(c["front"] for c in db.getAll(SearchParser().parse(q).cond))
+
+
+def test_add_remove_tags(db):
+    ids = db.insertMany([{"front": f"card{i}", "deck": "Default", "tag": ["old"]} for i in range(5)])
+
+    db.addTags(ids[:3], ["new", "marked"])
+    assert [db.getTags(cId) for cId in ids] == [{"old", "new", "marked"}] * 3 + [{"old"}] * 2
+    assert _search(db, "tag:new") == ["card0", "card1", "card2"]
+    assert _search(db, "is:marked") == ["card0", "card1", "card2"]
+
+    db.removeTags(ids[1:], ["old", "marked"])
+    assert [db.getTags(cId) for cId in ids] == [{"old", "new", "marked"}, {"new"}, {"new"}, set(), set()]
+    assert _search(db, "tag:old") == ["card0"]
+    assert _search(db, "-tag:new") == ["card3", "card4"]
+
+
+def test_failed_tag_edit_keeps_search(db):
+    ids = db.insertMany([{"front": "apple", "deck": "Default"}, {"front": "banana", "deck": "Default"}])
+
+    with pytest.raises(sqlite3.IntegrityError):
+        db.addTags([ids[0]], [None])
+    assert db.getTags(ids[0]) == set()
+
+    db.update(ids[1], {"front": "zebra"})
+    for q in ["zebra", "front:zebra", "front=zebra"]:
+        assert _search(db, q) == ["zebra"], q
+
+    db.insertMany([{"front": "zebra crossing", "deck": "Default"}])
+    assert _search(db, "zebra") == ["zebra", "zebra crossing"]
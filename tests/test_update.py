@@ -0,0 +1,66 @@
+import pytest
+
+from rep2recall.engine.db import Db
+from rep2recall.engine.search import SearchParser, mongo_filter
+
+
+def _cards(db: Db):
+    return [{k: v for k, v in c.items() if k != "modified"} for c in db.getAll()]
+
+
+@pytest.fixture
+def pair(tmp_path):
+    """
+    Two copies of a collection, for updateMany and for update on each card
+    """
+    dbs = [Db(str(tmp_path.joinpath(f"{i}.db"))) for i in range(2)]
+    for db in dbs:
+        db.insertMany([{
+            "front": f"card{i}",
+            "back": "back",
+            "deck": ["A", "A/B", "C"][i % 3],
+            "tag": ["t1", "t2"][:i % 3],
+            "srsLevel": i % 4,
+            "key": f"k{i}" if i % 2 else None,
+            "data": [{"key": "Pinyin", "value": f"p{i}"}] if i % 2 else None
+        } for i in range(10)])
+
+    yield dbs
+    for db in dbs:
+        db.close()
+
+
+@pytest.mark.parametrize("u", [
+    {"deck": "D/E"},
+    {"deck": "A"},
+    {"srsLevel": 3, "nextReview": "2020-01-01 00:00:00"},
+    {"front": "zebra", "back": "Zebra", "mnemonic": "stripes"},
+    {"tag": ["t2", "t3"]},
+    {"tag": []},
+    {"stat": {"streak": {"right": 2, "wrong": 1}, "extra": 1}},
+    {"data": [{"key": "Pinyin", "value": "zebra"}, {"key": "Meaning", "value": "horse"}]},
+    {"deck": "Z", "tag": ["zebra"], "srsLevel": 1}
+])
+def test_update_many(pair, u):
+    many, each = pair
+    cIds = [c["id"] for c in many.getAll()][2:8]
+
+    many.updateMany(cIds, dict(u))
+    for cId in cIds:
+        each.update(cId, dict(u))
+
+    assert _cards(many) == _cards(each)
+    for q in ["zebra", "front:zebra", "tag:zebra", "deck:D", "@pinyin:zebra", "meaning:horse"]:
+        cond = SearchParser().parse(q).cond
+        assert [c["id"] for c in many.getAll(cond)] == [c["id"] for c in each.getAll(cond)], q
+        assert [c["id"] for c in many.getAll(cond)] == [c["id"] for c in many.getAll() if mongo_filter(cond)(c)], q
+
+
+def test_update_many_modified(pair):
+    many, _ = pair
+    cIds = [c["id"] for c in many.getAll()][:3]
+
+    many.updateMany(cIds, {"srsLevel": 7})
+    modified = {c["id"]: c["modified"] for c in many.getAll()}
+    assert all(modified[cId] is not None for cId in cIds)
+    assert all(v is None for cId, v in modified.items() if cId not in cIds)